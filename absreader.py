@@ -1,6 +1,10 @@
 #!/usr/bin/python3
 
 import abc
+import array
+import io
+import zlib
+from alignment import Alignment
 
 class AbstractReader(abc.ABC):
 
@@ -15,5 +19,61 @@ class AbstractReader(abc.ABC):
         '''Return the contents of file_or_dir (provided by the user as an argument) as a list of the form [[taxa][aligned_characters][character_ids]]. [taxa] should contain the names of the taxa as strings. [aligned_characters] should contain an alignment of each taxon as a list in the form  [site_1, site_2, site_3, ... site_n], in the same order as the taxon names are given in [taxa]. [character_ids] should contain a human-readable identifier for each aligned character]'''
         pass
 
+    def getEncodedContents(self, file_or_dir):
+        '''Return the contents of file_or_dir as an Alignment (see alignment.py), which can also be used as a list of the form [[taxa], codes, [states], [character_ids]]. codes should be an array.array (or bytes-like object) of unsigned 8-bit or 16-bit integer state codes with one row of len(character_ids) codes for each taxon, in the same order as the taxon names are given in [taxa]. [states] should map each code to the state it encodes. [character_ids] can be None if the format has no character identifiers. The default implementation encodes the result of getContents; readers can override it to produce the codes directly. Raises ValueError if the contents cannot be read.'''
+        return encodeContents(self.getContents(file_or_dir), file_or_dir)
+
+# Magic bytes of the compressed formats that openFile decompresses on the fly, and the modules that read them
+COMPRESSION_MAGIC = [(b"\x1f\x8b", "gzip"), (b"BZh", "bz2"), (b"\xfd7zXZ\x00", "lzma")]
+COMPRESSED_SUFFIXES = [".gz", ".bz2", ".xz"]
+
+def openFile(path, binary=False):
+    '''Open an input file for reading, decompressing gzip, bzip2 and xz files incrementally as they are read. The compression is detected from the first bytes of the file. Returns a binary file object if binary is set, and a UTF-8 text file object (with newlines untranslated, as the csv module expects) otherwise.'''
+    with open(path, "rb") as f:
+        start = f.read(6)
+    f = None
+    for magic, module in COMPRESSION_MAGIC:
+        if start.startswith(magic):
+            f = __import__(module).open(path, "rb")
+            break
+    if f == None:
+        f = open(path, "rb")
+    if binary:
+        return f
+    return io.TextIOWrapper(f, encoding="utf-8", newline="")
+
+def getDecompressionErrors():
+    '''Return the exception types raised when reading a corrupt or truncated file opened with openFile'''
+    errors = [OSError, EOFError, zlib.error]
+    try:
+        import lzma
+        errors.append(lzma.LZMAError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+def encodeContents(content, source="alignment"):
+    '''Encode contents in the form returned by getContents in the form returned by getEncodedContents. Raises ValueError if the taxa have different numbers of characters.'''
+    taxa = content[0]
+    chars = content[1]
+    try:
+        names = content[2]
+    except IndexError:
+        names = None
+    states = []
+    state_codes = {}
+    codes = array.array("H")
+    for i in range(len(taxa)):
+        if len(chars[i]) != len(chars[0]):
+            raise ValueError("Unable to read %s correctly: taxon %s has %i characters, expected %i." % (source, taxa[i], len(chars[i]), len(chars[0])))
+        for c in chars[i]:
+            if c not in state_codes:
+                state_codes[c] = len(states)
+                states.append(c)
+            codes.append(state_codes[c])
+    if len(states) <= 256:
+        codes = array.array("B", codes)
+    return Alignment(taxa,codes,states,names)
+
 if __name__ == '__main__':
     print("Interface/abstract class definition for tiger-calculator file format readers")
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+import array
+import itertools
+
+# Translation tables mapping one state code to "1" and all other codes to "0", see Alignment.getSiteMasks
+_MASK_TABLES = {}
+
+def _maskTable(code):
+    table = _MASK_TABLES.get(code)
+    if table == None:
+        table = _MASK_TABLES[code] = bytes(0x31 if i == code else 0x30 for i in range(256))
+    return table
+
+class Alignment(object):
+    '''Integer-coded alignment as returned by the getEncodedContents method of the readers. codes is an array.array of unsigned 8-bit (or 16-bit, if there are more than 256 states) state codes with one row of n_sites codes for each taxon, states maps each code to the state it encodes, and names contains the character identifiers (or None if the format has none).
+
+    For compatibility with code that expects the list form [taxa, codes, states, names], an Alignment can be unpacked and indexed like that list.'''
+
+    __slots__ = ("taxa", "codes", "states", "names", "n_sites")
+
+    def __init__(self, taxa, codes, states, names=None):
+        if not isinstance(codes, array.array):
+            codes = array.array("B", codes)
+        self.taxa = taxa
+        self.codes = codes
+        self.states = states
+        self.names = names
+        self.n_sites = len(codes) // len(taxa) if len(taxa) > 0 else 0
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, i):
+        return (self.taxa, self.codes, self.states, self.names)[i]
+
+    def __iter__(self):
+        return iter((self.taxa, self.codes, self.states, self.names))
+
+    def getRow(self, i):
+        '''Return the codes of taxon i'''
+        return self.codes[i*self.n_sites:(i+1)*self.n_sites]
+
+    def getColumn(self, site, taxon_flags=None):
+        '''Return the codes of all taxa at site, or only of the taxa whose flag is set in taxon_flags (see getTaxonFlags)'''
+        column = self.codes[site::self.n_sites]
+        if taxon_flags != None:
+            column = array.array(self.codes.typecode, itertools.compress(column, taxon_flags))
+        return column
+
+    def getMissingCodes(self, ignored_chars):
+        '''Return the set of codes of the ignored (missing data) states'''
+        ignored_chars = set(ignored_chars)
+        return {code for code in range(len(self.states)) if self.states[code] in ignored_chars}
+
+    def getTaxonFlags(self, excluded_taxa):
+        '''Return a bytes object with a flag for each taxon that is not excluded, or None if no taxa are excluded. Raises ValueError if an excluded taxon is not in the alignment.'''
+        excluded_taxa = set(excluded_taxa) - {""}
+        if not excluded_taxa:
+            return None
+        for taxon in excluded_taxa:
+            if taxon not in self.taxa:
+                raise ValueError("Taxon %s not found in data." % taxon)
+        return bytes(taxon not in excluded_taxa for taxon in self.taxa)
+
+    def getSiteMasks(self, site, missing_codes=(), taxon_flags=None):
+        '''Return the set partition of site as a list of (code, bitmask) pairs in code order, leaving out the missing codes. Bit j of a bitmask is set if the j-th (included) taxon has the state. For 8-bit codes the bitmasks are built with bytes.translate on the whole column, so the taxa are not looped over in Python.'''
+        column = self.getColumn(site, taxon_flags)
+        codes = sorted(set(column).difference(missing_codes))
+        if column.typecode == "B":
+            column = column.tobytes()
+            return [(code, int(column.translate(_maskTable(code))[::-1], 2)) for code in codes]
+        masks = dict.fromkeys(codes, 0)
+        for j in range(len(column)):
+            if column[j] in masks:
+                masks[column[j]] |= 1 << j
+        return [(code, masks[code]) for code in codes]
+
+if __name__ == '__main__':
+    print("Alignment data structure for tiger-calculator")
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import formats
+import tiger
+
+N_PROCESSES = int(multiprocessing.cpu_count())
+JOBS_PER_PROCESS = 4
+JOB_KEYS = ["id", "in_file", "format", "ignored_chars", "excluded_taxa", "synonym_strategy", "engine"]
+
+def parseJob(line, defaults):
+    '''Parse a job from a JSON object on a single line. Keys missing from the job are taken from defaults. ignored_chars and excluded_taxa can be lists or comma-separated strings as on the tiger-calculator command line.'''
+    job = json.loads(line)
+    if not isinstance(job, dict):
+        raise ValueError("Job must be a JSON object")
+    for key in job.keys():
+        if key not in JOB_KEYS:
+            raise ValueError("Unknown job key %s" % key)
+    if "in_file" not in job:
+        raise ValueError("Job has no in_file")
+    job = dict(defaults, **job)
+    for key in ("in_file", "format", "synonym_strategy", "engine"):
+        if not isinstance(job[key], str):
+            raise ValueError("Job key %s must be a string" % key)
+    for key in ("ignored_chars", "excluded_taxa"):
+        if isinstance(job[key], str):
+            job[key] = job[key].split(",")
+        elif not isinstance(job[key], list) or not all(isinstance(value, str) for value in job[key]):
+            raise ValueError("Job key %s must be a list of strings or a comma-separated string" % key)
+    if job["engine"] not in tiger.ENGINE_NAMES:
+        raise ValueError("Unknown engine %s. Available engines: %s." % (job["engine"], ", ".join(tiger.ENGINE_NAMES)))
+    return job
+
+def readJobs(fp, defaults):
+    '''Yield (job, error) pairs from a JSON-lines manifest, one job per line. Empty lines and lines starting with # are skipped. Lines that cannot be parsed yield the line and an error message.'''
+    for line in fp:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        try:
+            yield parseJob(line, defaults), None
+        except ValueError as e:
+            yield line, str(e)
+
+def runJob(job):
+    '''Read the input of a job and calculate its TIGER rates in the current process. Returns a result record with the character names and rates, or with the error message the job failed with.'''
+    record = {"id": job.get("id"), "in_file": job["in_file"]}
+    try:
+        content = tiger.read_alignment(job["in_file"], job["format"], job["synonym_strategy"])
+        if job["engine"] == "blocked":
+            rates = tiger.blocked_rates(content, ignored_chars=job["ignored_chars"], excluded_taxa=job["excluded_taxa"])
+            names = content.names if content.names != None else range(1, content.n_sites + 1)
+        else:
+            partitions = tiger.Partitions(content, ignored_chars=job["ignored_chars"], excluded_taxa=job["excluded_taxa"])
+            rates = tiger.tiger_rates(partitions, engine=job["engine"])
+            names = partitions.names
+    except (ValueError, OSError) as e:
+        record["error"] = str(e)
+        return record
+    except Exception as e:
+        # Any other failure only fails this job, not the whole batch
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+        return record
+    record["characters"] = [str(name) for name in names]
+    record["rates"] = rates
+    return record
+
+def runBatch(jobs, out, n_processes=N_PROCESSES):
+    '''Run jobs from an iterable of (job, error) pairs (see readJobs) in a pool of n_processes worker processes that is kept alive for all jobs. Jobs run concurrently, each in a single worker, and a JSON-lines result record is written to out as soon as each job finishes, also while waiting for more jobs to be read. Records carry the index of the job in the manifest (not counting skipped lines) in "job", so they can be matched to jobs when they finish out of order. Returns the number of failed jobs.'''
+    failed = 0
+    lock = threading.Lock()
+
+    def write(record):
+        nonlocal failed
+        with lock:
+            if "error" in record:
+                failed += 1
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+    if n_processes <= 1:
+        for i, (job, error) in enumerate(jobs):
+            write(dict({"job": i}, **(runJob(job) if error == None else {"line": job, "error": error})))
+        return failed
+
+    # Keep a limited number of jobs queued, so jobs read from stdin start as they arrive
+    slots = threading.BoundedSemaphore(n_processes * JOBS_PER_PROCESS)
+
+    def finish(i, future):
+        # Called in a thread of the pool when the job finishes, so the record is written without waiting for the next job to be read
+        try:
+            record = future.result()
+        except Exception as e: # e.g. the worker process died
+            record = {"error": "%s: %s" % (type(e).__name__, e)}
+        write(dict({"job": i}, **record))
+        slots.release()
+
+    with tiger.process_pool(None, n_processes) as executor:
+        for i, (job, error) in enumerate(jobs):
+            if error != None:
+                write({"job": i, "line": job, "error": error})
+                continue
+            slots.acquire()
+            executor.submit(runJob, job).add_done_callback(functools.partial(finish, i))
+    return failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Calculate TIGER rates for many datasets in one process. Jobs are read as JSON objects, one per line, with the keys %s. Only in_file is required; the other keys default to the options below. One JSON result record is printed for each job as it finishes." % ", ".join(JOB_KEYS))
+    parser.add_argument(dest="manifest", help="JSON-lines file of jobs, or - to read jobs from stdin.", metavar="MANIFEST", type=str)
+    parser.add_argument("-f", "--format", dest="format", help="Default input format. Available formats: " + formats.getFormatsAsString(), default="", type=str)
+    parser.add_argument("-i", "--ignored-characters", dest="ignored_chars", help="Default comma-separated list of ignored characters.", default="", type=str)
+    parser.add_argument("-x", "--excluded-taxa", dest="excluded_taxa", help="Default comma-separated list of excluded taxa.", default="", type=str)
+    parser.add_argument("-s", "--synonym-strategy", dest="synonym_strategy", help="Default strategy for resolving synonyms. Available strategies: random, minimum, maximum.", default="minimum", type=str)
+    parser.add_argument("-e", "--engine", dest="engine", help="Default engine. Available engines: %s." % ", ".join(tiger.ENGINE_NAMES), default="patterns", choices=tiger.ENGINE_NAMES, type=str)
+    parser.add_argument("-p", "--processes", dest="n_processes", help="Number of worker processes. Default: %i (the detected number of logical CPUs). Currently only works on Linux and Mac." % N_PROCESSES, default=N_PROCESSES, type=int)
+    args = parser.parse_args()
+
+    n_processes = args.n_processes if os.name != 'nt' else 1
+    defaults = {"id": None,
+                "format": args.format,
+                "ignored_chars": args.ignored_chars,
+                "excluded_taxa": args.excluded_taxa,
+                "synonym_strategy": args.synonym_strategy,
+                "engine": args.engine}
+    if args.manifest == "-":
+        failed = runBatch(readJobs(sys.stdin, defaults), sys.stdout, n_processes)
+    else:
+        with open(args.manifest, "r", encoding="utf-8") as fp:
+            failed = runBatch(readJobs(fp, defaults), sys.stdout, n_processes)
+    exit(1 if failed else 0)
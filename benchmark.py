@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import formats
+import tiger
+
+STATE_SYMBOLS = string.digits + string.ascii_uppercase
+MISSING = "?"
+
+def generateStates(rng, n_taxa, n_sites, n_states, missing):
+    '''Return a list with [taxon][site] format of random states. Each site uses at most n_states states, and each state is missing with probability missing.'''
+    rows = [[] for i in range(n_taxa)]
+    for site in range(n_sites):
+        site_states = STATE_SYMBOLS[:rng.randint(1, n_states)]
+        for row in rows:
+            row.append(MISSING if rng.random() < missing else rng.choice(site_states))
+    return rows
+
+def writeFasta(path, rows):
+    '''Write an alignment in [taxon][site] format to a FASTA file'''
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(len(rows)):
+            sequence = "".join(rows[i])
+            f.write(">taxon%i\n" % i)
+            for j in range(0, len(sequence), 60):
+                f.write(sequence[j:j+60] + "\n")
+
+def writeHarvest(path, rows):
+    '''Write an alignment in [taxon][site] format to a harvest-style CSV file'''
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["taxon"] + ["c%i" % site for site in range(len(rows[0]) if rows else 0)])
+        for i in range(len(rows)):
+            writer.writerow(["taxon%i" % i] + rows[i])
+
+def writeCldf(path, rng, n_taxa, n_meanings, n_states, missing, synonyms):
+    '''Write a random CLDF dataset to directory path. Each meaning has at most n_states cognate sets. A language has no form for a meaning with probability missing, and two forms from different cognate sets with probability synonyms.'''
+    os.makedirs(path, exist_ok=True)
+    forms = []
+    cognates = []
+    for m in range(n_meanings):
+        n_cognates = rng.randint(1, n_states)
+        for lang in range(n_taxa):
+            if rng.random() < missing:
+                continue
+            cognate_sets = [rng.randrange(n_cognates)]
+            if n_cognates > 1 and rng.random() < synonyms:
+                cognate_sets.append(rng.choice([c for c in range(n_cognates) if c != cognate_sets[0]]))
+            for c in cognate_sets:
+                form_id = "f%i" % (len(forms) + 1)
+                forms.append([form_id, "L%i" % lang, "p%i" % m])
+                cognates.append(["c%i" % (len(cognates) + 1), form_id, "p%i-%i" % (m, c)])
+    tables = {"languages.csv": [["ID", "Name"]] + [["L%i" % lang, "Language%i" % lang] for lang in range(n_taxa)],
+              "parameters.csv": [["ID", "Name"]] + [["p%i" % m, "meaning%i" % m] for m in range(n_meanings)],
+              "forms.csv": [["ID", "Language_ID", "Parameter_ID"]] + forms,
+              "cognates.csv": [["ID", "Form_ID", "Cognateset_ID"]] + cognates}
+    for name, table in tables.items():
+        with open(os.path.join(path, name), "w", encoding="utf-8", newline="") as f:
+            csv.writer(f).writerows(table)
+
+def generateDataset(directory, format, n_taxa, n_sites, n_states, missing, synonyms, seed):
+    '''Write a random dataset in the specified format to directory and return its path. The same arguments always give the same dataset.'''
+    rng = random.Random("%s-%i-%i-%i-%s-%s-%s" % (format, n_taxa, n_sites, n_states, missing, synonyms, seed))
+    name = os.path.join(directory, "%s_%i_%i" % (format, n_taxa, n_sites))
+    if format == "cldf":
+        writeCldf(name, rng, n_taxa, n_sites, n_states, missing, synonyms)
+        return name
+    rows = generateStates(rng, n_taxa, n_sites, n_states, missing)
+    if format == "fasta":
+        writeFasta(name + ".fas", rows)
+        return name + ".fas"
+    writeHarvest(name + ".csv", rows)
+    return name + ".csv"
+
+def timeCall(repeat, function, *args, **kwargs):
+    '''Call function repeat times and return its last result and the wall times of the calls in seconds'''
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return result, times
+
+def readDataset(path, format):
+    '''Read a dataset with a fresh reader of the specified format'''
+    return tiger.read_alignment(path, format)
+
+def getVersion():
+    '''Return a description of the code and system being benchmarked'''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+def runBenchmarks(directory, formats_list, taxa_counts, site_counts, engines, process_counts, n_states=4, missing=0.1, synonyms=0.1, repeat=3, seed=1, log=sys.stderr):
+    '''Generate a dataset for each format, taxon count and site count, and time parsing, partition building, and rate computation with each engine and process count. Returns a list of result records with the best and all wall times of each phase.'''
+    results = []
+    for format in formats_list:
+        for n_taxa in taxa_counts:
+            for n_sites in site_counts:
+                path = generateDataset(directory, format, n_taxa, n_sites, n_states, missing, synonyms, seed)
+                dataset = {"format": format, "n_taxa": n_taxa, "n_sites": n_sites}
+
+                def record(phase, times, engine=None, n_processes=None):
+                    results.append(dict(dataset, phase=phase, engine=engine, processes=n_processes, best=min(times), times=times))
+                    print("%s %i taxa %i sites: %s%s %.4f s" % (format, n_taxa, n_sites, phase, "" if engine == None else " %s -p %i" % (engine, n_processes), min(times)), file=log)
+
+                content, times = timeCall(repeat, readDataset, path, format)
+                record("parse", times)
+                partitions, times = timeCall(repeat, tiger.Partitions, content, ignored_chars=[MISSING])
+                record("partitions", times)
+                for engine in engines:
+                    for n_processes in process_counts:
+                        if engine == "blocked":
+                            # The out-of-core engine builds its own partition file, so its time includes that
+                            rates, times = timeCall(repeat, tiger.blocked_rates, content, ignored_chars=[MISSING], n_processes=n_processes)
+                        else:
+                            rates, times = timeCall(repeat, tiger.tiger_rates, partitions, engine=engine, n_processes=n_processes)
+                        record("rates", times, engine, n_processes)
+    return results
+
+def resultKey(result):
+    return (result["format"], result["n_taxa"], result["n_sites"], result["phase"], result["engine"], result["processes"])
+
+def compareResults(old, new, tolerance=0.2, log=sys.stderr):
+    '''Compare the best times of matching results of two benchmark runs. Returns the results that are slower than in old by more than the fraction tolerance.'''
+    old_results = {resultKey(result): result for result in old}
+    regressions = []
+    for result in new:
+        previous = old_results.get(resultKey(result))
+        if previous == None:
+            continue
+        ratio = result["best"] / previous["best"] if previous["best"] > 0 else float("inf")
+        slower = ratio > 1 + tolerance
+        print("%s %i taxa %i sites: %s%s %.4f s -> %.4f s (x%.2f)%s" % (result["format"], result["n_taxa"], result["n_sites"], result["phase"], "" if result["engine"] == None else " %s -p %i" % (result["engine"], result["processes"]), previous["best"], result["best"], ratio, " REGRESSION" if slower else ""), file=log)
+        if slower:
+            regressions.append(result)
+    return regressions
+
+def parseList(text, type=str):
+    return [type(value) for value in text.split(",") if value != ""]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark tiger-calculator on synthetic datasets. Times parsing, partition building and rate computation for each engine and process count, and writes the results as JSON.")
+    parser.add_argument("-f", "--formats", dest="formats", help="Comma-separated list of formats to benchmark. Default: fasta,harvest,cldf.", default="fasta,harvest,cldf", type=str)
+    parser.add_argument("-t", "--taxa", dest="taxa", help="Comma-separated list of taxon counts. Default: 50,200.", default="50,200", type=str)
+    parser.add_argument("-s", "--sites", dest="sites", help="Comma-separated list of site (meaning) counts. Default: 500,2000.", default="500,2000", type=str)
+    parser.add_argument("--states", dest="states", help="Maximum number of states (cognate sets) per site. Default: 4.", default=4, type=int)
+    parser.add_argument("--missing", dest="missing", help="Fraction of missing data. Default: 0.1.", default=0.1, type=float)
+    parser.add_argument("--synonyms", dest="synonyms", help="Fraction of CLDF forms with a synonym. Default: 0.1.", default=0.1, type=float)
+    parser.add_argument("-e", "--engines", dest="engines", help="Comma-separated list of engines. Default: patterns,bitset.", default="patterns,bitset", type=str)
+    parser.add_argument("-p", "--processes", dest="processes", help="Comma-separated list of process counts. Default: 1,%i." % os.cpu_count(), default="1,%i" % os.cpu_count(), type=str)
+    parser.add_argument("-r", "--repeat", dest="repeat", help="Number of times each phase is timed. Default: 3.", default=3, type=int)
+    parser.add_argument("--seed", dest="seed", help="Random seed for the datasets. Default: 1.", default=1, type=int)
+    parser.add_argument("-d", "--data-dir", dest="data_dir", help="Keep the generated datasets in this directory instead of a temporary one.", default=None, type=str)
+    parser.add_argument("-o", "--output", dest="output", help="Write the results to this JSON file instead of stdout.", default=None, type=str)
+    parser.add_argument("--compare", dest="compare", help="Compare the results with a JSON file from an earlier run, and exit with status 1 if any phase is slower by more than --tolerance.", default=None, type=str)
+    parser.add_argument("--tolerance", dest="tolerance", help="Allowed slowdown with --compare as a fraction. Default: 0.2.", default=0.2, type=float)
+    args = parser.parse_args()
+
+    formats_list = parseList(args.formats)
+    engines = parseList(args.engines)
+    for format in formats_list:
+        if formats.getReader(format) == None:
+            print("Please specify formats from: " + formats.getFormatsAsString(), file=sys.stderr)
+            exit(1)
+    for engine in engines:
+        if engine not in tiger.ENGINE_NAMES:
+            print("Please specify engines from: " + ", ".join(tiger.ENGINE_NAMES), file=sys.stderr)
+            exit(1)
+    if not 1 <= args.states <= len(STATE_SYMBOLS):
+        print("The number of states must be between 1 and %i." % len(STATE_SYMBOLS), file=sys.stderr)
+        exit(1)
+
+    settings = {"states": args.states, "missing": args.missing, "synonyms": args.synonyms, "repeat": args.repeat, "seed": args.seed}
+    benchmark_args = (formats_list, parseList(args.taxa, int), parseList(args.sites, int), engines, parseList(args.processes, int), args.states, args.missing, args.synonyms, args.repeat, args.seed)
+    if args.data_dir != None:
+        os.makedirs(args.data_dir, exist_ok=True)
+        results = runBenchmarks(args.data_dir, *benchmark_args)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = runBenchmarks(directory, *benchmark_args)
+
+    output = {"version": getVersion(), "settings": settings, "results": results}
+    if args.output != None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=1)
+    else:
+        print(json.dumps(output, indent=1))
+
+    if args.compare != None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        if compareResults(old["results"], results, args.tolerance):
+            exit(1)
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+import array
+import mmap
+import sys
+import tiger
+
+# Partition file layout: MAGIC, then the number of taxa, number of sites, bytes per bitmask and offset of the index
+# as 8-byte little-endian integers, then the bitmasks of all states of all sites, and finally the index: the number
+# of bitmasks before each site (and after the last one) as 8-byte little-endian integers.
+MAGIC = b"TIGERPARTS1\n"
+HEADER_SIZE = len(MAGIC) + 4 * 8
+# Rough size in bytes of a decoded bitmask (int object) and of the per-site tuples, used to size the tiles
+INT_OVERHEAD = 32
+SITE_OVERHEAD = 160
+
+def writePartitionFile(path, alignment, missing_codes=(), taxon_flags=None):
+    '''Write the set partitions of all sites of an Alignment to a partition file, one site at a time, so that the bitmasks of all sites are never held in memory together. Raises ValueError if a site has no states left after removing the missing codes.'''
+    n_taxa = len(alignment.taxa) if taxon_flags == None else sum(taxon_flags)
+    mask_bytes = max(1, (n_taxa + 7) // 8)
+    index = array.array("Q", [0])
+    with open(path, "wb") as f:
+        f.write(MAGIC + bytes(4 * 8))
+        for site in range(alignment.n_sites):
+            masks = alignment.getSiteMasks(site, missing_codes, taxon_flags)
+            if not masks:
+                raise ValueError("Error: Empty character alignment at position " + str(site) + ". TIGER rates not calculated.")
+            f.write(b"".join(mask.to_bytes(mask_bytes, "little") for code, mask in masks))
+            index.append(index[-1] + len(masks))
+        index_offset = f.tell()
+        if sys.byteorder != "little":
+            index.byteswap()
+        index.tofile(f)
+        f.seek(len(MAGIC))
+        for value in (n_taxa, alignment.n_sites, mask_bytes, index_offset):
+            f.write(value.to_bytes(8, "little"))
+
+class PartitionFile(object):
+    '''Memory-mapped partition file written by writePartitionFile. Sites are decoded into the Partitions.bit_parts format (see tiger.py) only when requested, so the operating system can keep as much of the file in memory as fits.'''
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("Not a partition file")
+        values = [int.from_bytes(self.map[len(MAGIC)+8*i:len(MAGIC)+8*(i+1)], "little") for i in range(4)]
+        self.n_taxa, self.n_sites, self.mask_bytes, index_offset = values
+        self.index = memoryview(self.map)[index_offset:index_offset + 8 * (self.n_sites + 1)].cast("Q")
+        self.swap = sys.byteorder != "little"
+
+    def close(self):
+        if hasattr(self, "index"):
+            self.index.release()
+        self.map.close()
+        self.file.close()
+
+    def getIndex(self, site):
+        value = self.index[site]
+        if self.swap:
+            value = int.from_bytes(value.to_bytes(8, "little"), "big")
+        return value
+
+    def getSites(self, start, stop):
+        '''Return the partitions of sites start to stop - 1 as a list of (tuple of bitmasks of the states, bitmask of taxa without missing data) pairs'''
+        mask_bytes = self.mask_bytes
+        sites = []
+        position = HEADER_SIZE + self.getIndex(start) * mask_bytes
+        for site in range(start, stop):
+            end = HEADER_SIZE + self.getIndex(site + 1) * mask_bytes
+            data = self.map[position:end]
+            masks = tuple(int.from_bytes(data[i:i+mask_bytes], "little") for i in range(0, len(data), mask_bytes))
+            valid = 0
+            for mask in masks:
+                valid |= mask
+            sites.append((masks, valid))
+            position = end
+        return sites
+
+    def getBlockSize(self, memory_budget):
+        '''Return the number of sites per tile, so that a block of analyzed sites and a block of compared sites fit in memory_budget bytes when decoded'''
+        masks_per_site = self.getIndex(self.n_sites) / max(1, self.n_sites)
+        site_size = SITE_OVERHEAD + masks_per_site * (INT_OVERHEAD + self.mask_bytes)
+        return max(1, min(self.n_sites, int(memory_budget // (2 * site_size))))
+
+def calculateBlockSums(path, start, stop, block_size):
+    '''Compare the sites start to stop - 1 of a partition file against all other sites, one tile of block_size compared sites at a time. Returns a list with the agreement sums of each analyzed site as a dict with [denominator] format, where each terminal node contains the sum of the numerators of pa(i,j).'''
+    partition_file = PartitionFile(path)
+    try:
+        rows = partition_file.getSites(start, stop)
+        sums = [{} for row in rows]
+        for block_start in range(0, partition_file.n_sites, block_size):
+            block_stop = min(partition_file.n_sites, block_start + block_size)
+            columns = rows if (block_start, block_stop) == (start, stop) else partition_file.getSites(block_start, block_stop)
+            compared = [(masks, 1) for masks, valid in columns]
+            for i in range(len(rows)):
+                tiger.add_sums(sums[i], tiger.agreement_sums(rows[i], compared))
+                if block_start <= start + i < block_stop:
+                    sums[i][len(rows[i][0])] -= len(rows[i][0]) # compared against itself with pa(i,i) = 1
+            del columns, compared
+        return sums
+    finally:
+        partition_file.close()
+
+if __name__ == '__main__':
+    print("Out-of-core partition files for tiger-calculator")
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+import array
+import hashlib
+import json
+import os
+import sys
+from alignment import Alignment
+
+MAGIC = b"TIGERCACHE1\n"
+SUFFIX = ".tiger-cache"
+
+def getCachePath(in_file, format, options, cache_dir=None):
+    '''Return the path of the cache file for in_file read with the specified format and reader options. By default the cache file is placed next to the input file or directory.'''
+    in_file = os.path.abspath(in_file).rstrip(os.sep)
+    if cache_dir == None:
+        cache_dir = os.path.dirname(in_file)
+    name = ".".join([os.path.basename(in_file), format] + [str(options[k]) for k in sorted(options.keys())])
+    return os.path.join(cache_dir, name + SUFFIX)
+
+def getCacheKey(in_file, format, options):
+    '''Return a key identifying the input and reader options. The key changes when the path, size or modification time of the input file, or of any file in the input directory, changes. A CLDF dataset given as one of its files is read from the directory of the file, so the key covers the whole directory.'''
+    in_file = os.path.abspath(in_file)
+    if format == "cldf" and not os.path.isdir(in_file):
+        in_file = os.path.dirname(in_file)
+    if os.path.isdir(in_file):
+        paths = [os.path.join(in_file, f) for f in sorted(os.listdir(in_file))]
+        paths = [p for p in paths if os.path.isfile(p) and SUFFIX not in p]
+    else:
+        paths = [in_file]
+    stats = [[p, os.stat(p).st_size, os.stat(p).st_mtime_ns] for p in paths]
+    description = json.dumps([stats, format, options], sort_keys=True)
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+def loadCache(path, key):
+    '''Return the cached reader contents as an Alignment, or None if the cache file does not exist or does not match the key.'''
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            if header["key"] != key:
+                return None
+            codes = array.array(header["typecode"])
+            codes.fromfile(f, header["n_codes"])
+    except (OSError, EOFError, ValueError, KeyError):
+        return None
+    if header["byteorder"] != sys.byteorder:
+        codes.byteswap()
+    return Alignment(header["taxa"],codes,header["states"],header["names"])
+
+def saveCache(path, key, content):
+    '''Write reader contents in the form returned by getEncodedContents to the cache file. The file is written under a temporary name and then renamed, so an interrupted write never leaves a corrupt cache behind.'''
+    taxa, codes, states, names = content
+    if not isinstance(codes, array.array):
+        codes = array.array("B", codes)
+    header = {"key": key,
+              "taxa": taxa,
+              "states": states,
+              "names": list(names) if names != None else None,
+              "typecode": codes.typecode,
+              "byteorder": sys.byteorder,
+              "n_codes": len(codes)}
+    header = json.dumps(header).encode("utf-8")
+    tmp_path = "%s.%i.tmp" % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            codes.tofile(f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("Could not write cache file %s: %s" % (path, e), file=sys.stderr)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+if __name__ == '__main__':
+    print("Cache of parsed input files for tiger-calculator")
@@ -1,11 +1,15 @@
 #!/usr/bin/python3
 
 import absreader
+import array
 import collections
 import csv
+import operator
 import os
-import sys
 import random
+from alignment import Alignment
+
+MISSING = "?"
 
 class CldfReader(absreader.AbstractReader):
 
@@ -14,153 +18,180 @@ class CldfReader(absreader.AbstractReader):
 
     def __init__(self):
         self.synonym_strategy = "minimum"
-    
+
     def __del__(self):
         pass
-        
+
     def getContents(self, file_or_dir):
+        taxa, codes, states, meanings = self.getEncodedContents(file_or_dir)
+        chars = []
+        for i in range(len(taxa)):
+            chars.append([states[c] for c in codes[i*len(meanings):(i+1)*len(meanings)]])
+        return [taxa,chars,meanings]
+
+    def getEncodedContents(self, file_or_dir):
+        '''Read the CLDF dataset with languages, meanings and cognate sets coded as integers, and return the resolved cognate classes as a state code array. Code 0 is missing data and code k the (k-1)th cognate class of a meaning in order of cognate set ID.'''
+        taxa, meanings, cognate_names, cognates = self.readCognates(file_or_dir)
+
+        # Resolve synonyms
+        resolved = resolve_synonyms(cognates, cognate_names, self.synonym_strategy)
+
+        return encode_cognates(taxa, meanings, cognate_names, resolved)
+
+    def readCognates(self, file_or_dir):
+        '''Read the CLDF dataset. Returns the sorted taxa, the sorted meanings, the cognate set IDs, and a list with [meaning][taxon] format, where each terminal node is a set of cognate set codes (indices to the cognate set IDs). Taxa without any cognates for a meaning are left out. Raises ValueError if the dataset cannot be read.'''
         if file_or_dir == None:
-            print("Please specify an input CLDF dataset.", file=sys.stderr)
-            exit(1)
+            raise ValueError("Please specify an input CLDF dataset.")
         if not os.path.exists(file_or_dir):
-            print("Dataset %s does not exist." % file_or_dir, file=sys.stderr)
-            exit(1)
+            raise ValueError("Dataset %s does not exist." % file_or_dir)
         if not os.path.isdir(file_or_dir):
             file_or_dir = os.path.dirname(file_or_dir)
-        if not all((os.path.exists(os.path.join(file_or_dir, x)) for x in
+        if not all((find_table(file_or_dir, x) != None for x in
             ("languages.csv", "forms.csv", "cognates.csv"))):
-            print("CLDF dataset does not use standard filenames.", file=sys.stderr)
-            exit(1)
+            raise ValueError("CLDF dataset does not use standard filenames.")
 
         # Read CLDF data
-        # This is basically a bunch of quick and dirty manual JOINs of RDBMS
-        # tables, each encoded as CSV files.
+        # This is basically a bunch of manual JOINs of RDBMS tables, each
+        # encoded as CSV files, done with dict indexes.
         lang_names = {}
-        with open(os.path.join(file_or_dir, "languages.csv"), "r", encoding="utf-8") as fp:
-            reader = csv.DictReader(fp)
-            for row in reader:
-                lang_names[row["ID"]] = row["Name"]
-
-        taxa = list(lang_names.values())
+        for lang_id, lang_name in read_columns(find_table(file_or_dir, "languages.csv"), ("ID", "Name")):
+            lang_names[lang_id] = lang_name
 
         # Correct for duplicated names
-        if len(set(taxa)) != len(taxa):
-            for lang_id, lang_name in lang_names.items():
-                if taxa.count(lang_name) > 1:
-                    lang_names[lang_id] = lang_name + "_" + lang_id
-            taxa = list(lang_names.values())
+        name_counts = collections.Counter(lang_names.values())
+        for lang_id, lang_name in lang_names.items():
+            if name_counts[lang_name] > 1:
+                lang_names[lang_id] = lang_name + "_" + lang_id
+        taxa = sorted(lang_names.values())
         assert len(set(taxa)) == len(taxa)
-        taxa.sort()
+        taxon_index = {taxa[i]: i for i in range(len(taxa))}
+        lang_index = {lang_id: taxon_index[lang_name] for lang_id, lang_name in lang_names.items()}
 
         param_names = {}
-        with open(os.path.join(file_or_dir, "parameters.csv"), "r", encoding="utf-8") as fp:
-            reader = csv.DictReader(fp)
-            for row in reader:
-                param_names[row["ID"]] = row["Name"]
-
-        form_to_param = {}
-        form_to_lang = {}
-        with open(os.path.join(file_or_dir, "forms.csv"), "r", encoding="utf-8") as fp:
-            reader = csv.DictReader(fp)
-            for row in reader:
-                form_to_param[row["ID"]] = param_names[row["Parameter_ID"]]
-                form_to_lang[row["ID"]] = lang_names[row["Language_ID"]]
-        meanings = set(form_to_param.values())
-
-        cognates = {}
-        for taxon in taxa:
-            cognates[taxon] = {}
-            for meaning in meanings:
-                cognates[taxon][meaning] = set()
-
-        with open(os.path.join(file_or_dir, "cognates.csv"), "r", encoding="utf-8") as fp:
-            reader = csv.DictReader(fp)
-            for row in reader:
-                lang = form_to_lang[row["Form_ID"]]
-                assert lang in taxa
-                meaning = form_to_param[row["Form_ID"]]
-                cognate = row["Cognateset_ID"]
-                cognates[lang][meaning].add(cognate)
-
-        # Resolve synonyms
-        cognates = resolve_synonyms(taxa, meanings, cognates, self.synonym_strategy)
-
-        # Convert to tiger-calculator form
-        meanings = list(set(form_to_param.values()))
-        meanings.sort()
-        for meaning in meanings:
-            all_values = list(set((cognates[l].get(meaning, "?") for l in taxa)))
-            if "?" in all_values:
-                all_values.remove("?")
-            all_values.sort()
-            for taxon in taxa:
-                cognates[taxon][meaning] = all_values.index(cognates[taxon][meaning]) if (meaning in cognates[taxon] and cognates[taxon][meaning] != "?") else "?"
-
-        chars = []
-        for taxon in taxa:
-            alignment = []
-            for meaning in meanings:
-                alignment.append(cognates[taxon][meaning])
-            chars.append(alignment)
-
-        return [taxa,chars,meanings]
- 
-def resolve_synonyms(languages, meanings, cognates, strategy):
+        for param_id, param_name in read_columns(find_table(file_or_dir, "parameters.csv"), ("ID", "Name")):
+            param_names[param_id] = param_name
+
+        forms = {} # [form_id] format, each terminal node contains a tuple of (taxon index, meaning name)
+        for form_id, lang_id, param_id in read_columns(find_table(file_or_dir, "forms.csv"), ("ID", "Language_ID", "Parameter_ID")):
+            forms[form_id] = (lang_index[lang_id], param_names[param_id])
+        meanings = sorted(set(meaning for lang, meaning in forms.values()))
+        meaning_index = {meanings[i]: i for i in range(len(meanings))}
+        for form_id, (lang, meaning) in forms.items():
+            forms[form_id] = (lang, meaning_index[meaning])
+
+        cognate_names = []
+        cognate_codes = {}
+        cognates = [{} for meaning in meanings]
+        for form_id, cognate in read_columns(find_table(file_or_dir, "cognates.csv"), ("Form_ID", "Cognateset_ID")):
+            if cognate == MISSING:
+                continue
+            lang, meaning = forms[form_id]
+            code = cognate_codes.get(cognate)
+            if code == None:
+                code = cognate_codes[cognate] = len(cognate_names)
+                cognate_names.append(cognate)
+            options = cognates[meaning].get(lang)
+            if options == None:
+                cognates[meaning][lang] = {code}
+            else:
+                options.add(code)
+
+        return taxa, meanings, cognate_names, cognates
+
+def find_table(directory, name):
+    '''Return the path of a CSV table of the dataset in directory, which may also be gzip, bzip2 or xz compressed, or None if it does not exist'''
+    for suffix in [""] + absreader.COMPRESSED_SUFFIXES:
+        path = os.path.join(directory, name + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+def read_columns(path, columns):
+    '''Iterate over the rows of a CSV file (optionally compressed) with a header, yielding the values of the specified (at least two) columns as tuples'''
+    if path == None:
+        raise ValueError("CLDF dataset does not use standard filenames.")
+    try:
+        with absreader.openFile(path) as fp:
+            reader = csv.reader(fp)
+            header = next(reader)
+            getter = operator.itemgetter(*[header.index(column) for column in columns])
+            yield from map(getter, filter(None, reader))
+    except absreader.getDecompressionErrors() as e:
+        raise ValueError("Unable to read %s: %s" % (path, e))
+
+def encode_cognates(taxa, meanings, cognate_names, resolved):
+    '''Convert resolved cognates in [meaning][taxon] format to tiger-calculator form. Returns an Alignment with the meanings as character identifiers, as described in AbstractReader.getEncodedContents.'''
+    n_classes = 0
+    values = []
+    for meaning in range(len(meanings)):
+        all_values = sorted(set(resolved[meaning].values()), key=lambda c: cognate_names[c])
+        values.append({all_values[i]: i + 1 for i in range(len(all_values))})
+        n_classes = max(n_classes, len(all_values))
+    states = [MISSING] + list(range(n_classes))
+    codes = array.array("B" if len(states) <= 256 else "H", [0]) * (len(taxa) * len(meanings))
+    for meaning in range(len(meanings)):
+        for lang, cognate in resolved[meaning].items():
+            codes[lang*len(meanings) + meaning] = values[meaning][cognate]
+    return Alignment(taxa,codes,states,meanings)
+
+def resolve_synonyms(cognates, cognate_names, strategy):
+    '''Pick a single cognate set for each language and meaning. cognates should be in the [meaning][taxon] format returned by CldfReader.readCognates. Returns a list with [meaning][taxon] format, where each terminal node is a cognate set code.'''
     if strategy == "random":
-        return resolve_synonyms_random(languages, meanings, cognates)
+        return resolve_synonyms_random(cognates, cognate_names)
     elif strategy == "minimum":
-        return resolve_synonyms_minimax(languages, meanings, cognates, "min")
+        return resolve_synonyms_minimax(cognates, cognate_names, "min")
     elif strategy == "maximum":
-        return resolve_synonyms_minimax(languages, meanings, cognates, "max")
-
-def resolve_synonyms_random(languages, meanings, cognates):
-    for meaning in meanings:
-        for lang in languages:
-            if not cognates[lang][meaning]:
-                cognates[lang][meaning] = "?"
-            elif len(cognates[lang][meaning]) == 1:
-                cognates[lang][meaning] = cognates[lang][meaning].pop()
+        return resolve_synonyms_minimax(cognates, cognate_names, "max")
+    raise ValueError("Unknown synonym strategy %s." % strategy)
+
+def resolve_synonyms_random(cognates, cognate_names, rng=random):
+    resolved = []
+    for meaning_cognates in cognates:
+        resolved.append({})
+        for lang, options in meaning_cognates.items():
+            if len(options) == 1:
+                resolved[-1][lang] = next(iter(options))
             else:
-                cognates[lang][meaning] = random.sample(cognates[lang][meaning], 1)[0]
-    return cognates
-
-def resolve_synonyms_minimax(languages, meanings, cognates, mode="min"):
-    for meaning in meanings:
+                resolved[-1][lang] = rng.choice(sorted(options))
+    return resolved
+
+def resolve_synonyms_minimax(cognates, cognate_names, mode="min"):
+    resolved = []
+    for meaning_cognates in cognates:
+        resolved.append({})
+        # Make easy assignments, and collect the hard cases with synonyms
+        attested_cognates = set()
+        hard_langs = []
+        for lang, options in meaning_cognates.items():
+            if len(options) == 1:
+                resolved[-1][lang] = next(iter(options))
+                attested_cognates.add(resolved[-1][lang])
+            else:
+                hard_langs.append(lang)
+        if not hard_langs:
+            continue
         # Count cognate classes
         cognate_class_counts = collections.Counter()
-        for lang in languages:
-            for c in cognates[lang][meaning]:
-                if c != "?":
-                    cognate_class_counts[c] += 1
-        # Divide languages into easy and hard cases
-        easy_langs = [l for l in languages if len(cognates[l][meaning]) < 2]
-        hard_langs = [l for l in languages if l not in easy_langs]
-        # Make easy assignments
-        attested_cognates = set()
-        for lang in easy_langs:
-            if not cognates[lang][meaning]:
-                cognates[lang][meaning] = "?"
-            elif len(cognates[lang][meaning]) == 1:
-                cognates[lang][meaning] = cognates[lang][meaning].pop()
-            attested_cognates.add(cognates[lang][meaning])
+        for options in meaning_cognates.values():
+            cognate_class_counts.update(options)
         # Make hard assignments
-        for lang in hard_langs:
-            options = [(cognate_class_counts[c], c) for c in cognates[lang][meaning]]
+        for lang in sorted(hard_langs):
+            options = [(cognate_class_counts[c], cognate_names[c], c) for c in meaning_cognates[lang]]
             # Sort cognates from rare to common if we want to maximise cognate
             # class count, or from common to rare if we want to minimise it.
             options.sort(reverse = mode == "min")
             # Preferentially assign a cognate which has already been
             # assigned if we're trying to minimise, or one which has
             # not if we're trying to maximise.
-            for n, c in options:
+            for n, name, c in options:
                 if (mode == "min" and c in attested_cognates) or (mode == "max" and c not in attested_cognates):
-                    cognates[lang][meaning] = c
+                    resolved[-1][lang] = c
                     break
             # Otherwise just pick the most/least frequent cognate.
             else:
-                cognates[lang][meaning] = options[0][1]
-            attested_cognates.add(cognates[lang][meaning])
-    return cognates
+                resolved[-1][lang] = options[0][2]
+            attested_cognates.add(resolved[-1][lang])
+    return resolved
 
 if __name__ == '__main__':
     print("CLDF reader class for tiger-calculator")
@@ -1,7 +1,8 @@
 #!/usr/bin/python3
 
 import absreader
-import sys
+import array
+from alignment import Alignment
 
 class FastaReader(absreader.AbstractReader):
 
@@ -15,44 +16,72 @@ class FastaReader(absreader.AbstractReader):
         pass
         
     def getContents(self, file_or_dir):
+        taxa, codes, states, names = self.getEncodedContents(file_or_dir)
+        n_sites = len(codes) // len(taxa) if taxa else 0
+        chars = ["".join(states[c] for c in codes[i*n_sites:(i+1)*n_sites]) for i in range(len(taxa))]
+        return [taxa,chars]
+
+    def getEncodedContents(self, file_or_dir):
+        '''Read the FASTA file (optionally gzip, bzip2 or xz compressed) line by line, appending the sequence of each taxon directly to a state code array in which the code of each ASCII state is its ASCII value. Lines with other characters are decoded as UTF-8, and each new non-ASCII state gets the next free code.'''
         if file_or_dir == None:
-            print("Please specify an input FASTA file.", file=sys.stderr)
-            exit(1)
-        try:
-            f = open(file_or_dir,"r")
-            infile = f.readlines()
-            f.close()
-        except FileNotFoundError:
-            print("Could not find FASTA file %s" % file_or_dir, file=sys.stderr)
-            exit(1)
-        # parse fasta to two arrays (one with taxa and another with chars)
+            raise ValueError("Please specify an input FASTA file.")
         taxa = []
-        chars = []
-        current_chars = ""
-        for line in infile:
-            line = line.strip().rstrip()
-            if len(line) == 0:          # empty line
-                continue
-            if line[0] == ";":          # comment line
-                continue
-            if line[0] == ">":          # taxon name line
-                taxa.append(line[1:])
-                if current_chars != "":
-                    chars.append(current_chars)
-                    current_chars = ""
-            else:                       # character line
-                current_chars += line
-        if current_chars != "":
-            chars.append(current_chars)
-            current_chars = ""
+        codes = array.array("B")
+        states = [chr(i) for i in range(128)]
+        state_codes = {states[i]: i for i in range(len(states))}
+        n_sites = None
+        record_start = 0 # position of the current taxon in codes
+        record_line = 0  # line number of the current taxon name
         try:
-            assert(len(taxa) == len(chars))
-            for i in chars:
-                assert(len(i) == len(chars[0]))
-        except AssertionError:
-            print("Unable to read file %s correctly. Please ensure that the input file is in FASTA format." % file_or_dir, file=sys.stderr)
-            exit(1)
-        return [taxa,chars]
+            with absreader.openFile(file_or_dir, binary=True) as f:
+                for line_number, line in enumerate(f, 1):
+                    line = line.strip()
+                    if len(line) == 0:          # empty line
+                        continue
+                    if line[0:1] == b";":       # comment line
+                        continue
+                    if line[0:1] == b">":       # taxon name line
+                        if taxa:
+                            n_sites = self._checkRecord(file_or_dir, taxa[-1], record_line, len(codes) - record_start, n_sites)
+                        taxa.append(line[1:].decode("utf-8"))
+                        record_start = len(codes)
+                        record_line = line_number
+                    else:                       # character line
+                        if not taxa:
+                            self._error(file_or_dir, "characters before the first taxon name on line %i." % line_number)
+                        if line.isascii() and codes.typecode == "B":
+                            codes.frombytes(line)
+                        elif line.isascii():
+                            codes.extend(line)
+                        else:
+                            sequence = line.decode("utf-8")
+                            for state in sequence:
+                                if state not in state_codes:
+                                    state_codes[state] = len(states)
+                                    states.append(state)
+                            if codes.typecode == "B" and len(states) > 256:
+                                codes = array.array("H", codes)
+                            codes.extend(state_codes[state] for state in sequence)
+        except FileNotFoundError:
+            raise ValueError("Could not find FASTA file %s" % file_or_dir)
+        except absreader.getDecompressionErrors() as e:
+            self._error(file_or_dir, "%s." % e)
+        except UnicodeDecodeError:
+            self._error(file_or_dir, "line %i is not valid UTF-8." % line_number)
+        if taxa:
+            self._checkRecord(file_or_dir, taxa[-1], record_line, len(codes) - record_start, n_sites)
+        return Alignment(taxa,codes,states,None)
+
+    def _checkRecord(self, file_or_dir, taxon, line_number, length, n_sites):
+        '''Check the sequence length of a finished record against the previous records. Returns the alignment length.'''
+        if length == 0:
+            self._error(file_or_dir, "taxon %s on line %i has no characters." % (taxon, line_number))
+        if n_sites != None and length != n_sites:
+            self._error(file_or_dir, "taxon %s on line %i has %i characters, expected %i." % (taxon, line_number, length, n_sites))
+        return length
+
+    def _error(self, file_or_dir, message):
+        raise ValueError("Unable to read file %s correctly: %s Please ensure that the input file is in FASTA format." % (file_or_dir, message))
         
 if __name__ == '__main__':
     print("FASTA reader class for tiger-calculator")
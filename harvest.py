@@ -1,9 +1,21 @@
 #!/usr/bin/python3
 
 import absreader
+import array
 import csv
 import os
-import sys
+from alignment import Alignment
+
+class _StateCodes(dict):
+    '''Dict from states to codes that assigns the next code to each new state'''
+
+    def __init__(self):
+        self.states = []
+
+    def __missing__(self, state):
+        code = self[state] = len(self.states)
+        self.states.append(state)
+        return code
 
 class HarvestReader(absreader.AbstractReader):
 
@@ -12,32 +24,65 @@ class HarvestReader(absreader.AbstractReader):
 
     def __init__(self):
         pass
-    
+
     def __del__(self):
         pass
-        
+
     def getContents(self, file_or_dir):
+        taxa, codes, states, names = self.getEncodedContents(file_or_dir)
+        chars = []
+        for i in range(len(taxa)):
+            chars.append([states[c] for c in codes[i*len(names):(i+1)*len(names)]])
+        return [taxa,chars,names]
+
+    def getEncodedContents(self, file_or_dir):
+        '''Read the CSV file (optionally gzip, bzip2 or xz compressed) row by row, encoding the states of each row into a state code array as it is read. Rows where every state is a single ASCII character are encoded in one bytes.translate call. Empty rows are skipped, and rows with a different number of columns than the header are reported as errors.'''
         if file_or_dir == None:
-            print("Please specify an input Harvest-style CSV file.", file=sys.stderr)
-            exit(1)
+            raise ValueError("Please specify an input Harvest-style CSV file.")
         if not os.path.exists(file_or_dir):
-            print("Dataset %s does not exist." % file_or_dir, file=sys.stderr)
-            exit(1)
-
-        with open(file_or_dir, "r") as fp:
-            reader = csv.reader(fp)
-            headers = next(reader)
-            N_features = len(headers) - 1
-            taxa = []
-            chars = []
-            names = headers[1:]
-            try:
+            raise ValueError("Dataset %s does not exist." % file_or_dir)
+
+        taxa = []
+        state_codes = _StateCodes()
+        codes = array.array("B")
+        table = bytearray(256) # codes of the single-character ASCII states, by byte value
+        known = set()          # byte values of the single-character ASCII states in table
+        try:
+            with absreader.openFile(file_or_dir) as fp:
+                reader = csv.reader(fp)
+                headers = next(reader, None)
+                if headers == None:
+                    self._error(file_or_dir, "the file is empty.")
+                names = headers[1:]
                 for row in reader:
+                    if not row:
+                        continue
+                    if len(row) != len(headers):
+                        self._error(file_or_dir, "row of taxon %s on line %i has %i columns, expected %i." % (row[0], reader.line_num, len(row), len(headers)))
                     taxa.append(row[0])
-                    chars.append(row[1:])
-            except IndexError:
-                pass
-            return [taxa,chars,names]
-        
+                    fields = row[1:]
+                    joined = "".join(fields)
+                    if codes.typecode == "B" and len(joined) == len(fields) and "" not in fields and joined.isascii():
+                        # Fast path: every state is a single ASCII character, so the whole row is encoded with bytes.translate
+                        raw = joined.encode("ascii")
+                        if not known.issuperset(raw):
+                            for byte in dict.fromkeys(raw):
+                                if byte not in known:
+                                    table[byte] = min(state_codes[chr(byte)], 255)
+                                    known.add(byte)
+                        if len(state_codes.states) <= 256:
+                            codes.frombytes(raw.translate(table))
+                            continue
+                    row_codes = list(map(state_codes.__getitem__, fields))
+                    if codes.typecode == "B" and len(state_codes.states) > 256:
+                        codes = array.array("H", codes)
+                    codes.extend(row_codes)
+        except absreader.getDecompressionErrors() + (csv.Error, UnicodeDecodeError) as e:
+            self._error(file_or_dir, "%s." % e)
+        return Alignment(taxa,codes,state_codes.states,names)
+
+    def _error(self, file_or_dir, message):
+        raise ValueError("Unable to read file %s correctly: %s Please ensure that the input file is a Harvest-style CSV file." % (file_or_dir, message))
+
 if __name__ == '__main__':
     print("Harvest-style CSV reader class for tiger-calculator")
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+import argparse
+import array
+import ast
+import heapq
+import sys
+
+# The matrix is stored as a float32 .npy file (format version 1.0), which can be opened with numpy.load(path, mmap_mode="r")
+MAGIC = b"\x93NUMPY\x01\x00"
+ITEM_SIZE = 4
+
+def createMatrix(path, n):
+    '''Create an n x n float32 .npy file for partition agreements. The rows are filled in later with writeRows, so the matrix never has to fit in memory.'''
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%i, %i), }" % (n, n)
+    padding = 64 - (len(MAGIC) + 2 + len(header) + 1) % 64
+    header = header + " " * padding + "\n"
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(2, "little"))
+        f.write(header.encode("latin1"))
+        f.truncate(f.tell() + n * n * ITEM_SIZE)
+
+def readHeader(f):
+    '''Return the matrix size and the offset of the first row in an open matrix file'''
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a partition agreement matrix file")
+    header_len = int.from_bytes(f.read(2), "little")
+    header = ast.literal_eval(f.read(header_len).decode("latin1"))
+    if header["descr"] != "<f4" or header["fortran_order"]:
+        raise ValueError("Not a partition agreement matrix file")
+    return header["shape"][0], f.tell()
+
+def writeRows(path, rows):
+    '''Write rows to the matrix file. rows should be a dict with [row_index] format, where each terminal node is a float array of pa(i,j) values.'''
+    with open(path, "r+b") as f:
+        n, offset = readHeader(f)
+        for i in sorted(rows.keys()):
+            row = rows[i]
+            if sys.byteorder != "little":
+                row = array.array("f", row)
+                row.byteswap()
+            f.seek(offset + i * n * ITEM_SIZE)
+            f.write(row.tobytes())
+
+def getRow(path, i):
+    '''Return the pa(i,j) values of character i (counting from 0 in alignment order) as a float array, reading only that row from the file'''
+    with open(path, "rb") as f:
+        n, offset = readHeader(f)
+        if not 0 <= i < n:
+            raise IndexError("Character %i not in matrix of %i characters" % (i, n))
+        f.seek(offset + i * n * ITEM_SIZE)
+        row = array.array("f")
+        row.fromfile(f, n)
+    if sys.byteorder != "little":
+        row.byteswap()
+    return row
+
+def getTopConflicts(path, i, k=10):
+    '''Return the k characters with the lowest partition agreement with character i, as a list of (character, pa) pairs'''
+    row = getRow(path, i)
+    return heapq.nsmallest(k, ((j, row[j]) for j in range(len(row)) if j != i), key=lambda item: item[1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query a partition agreement matrix written by tiger-calculator.")
+    parser.add_argument(dest="matrix_file", help="Matrix file to query.", metavar="MATRIX_FILE", type=str)
+    parser.add_argument(dest="character", help="Character to query, counting from 0 in alignment order.", metavar="CHARACTER", type=int)
+    parser.add_argument("-k", "--top", dest="top", help="Print only the K most conflicting characters.", default=None, type=int)
+    args = parser.parse_args()
+    if args.top == None:
+        pairs = enumerate(getRow(args.matrix_file, args.character))
+    else:
+        pairs = getTopConflicts(args.matrix_file, args.character, args.top)
+    for j, pa in pairs:
+        print("%i\t%s" % (j, pa))
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+import contextlib
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+class Profile(object):
+    '''Collects the wall and CPU time of the phases of a run, and reports them with the peak memory use as a JSON document'''
+
+    def __init__(self):
+        self.phases = []
+        self.values = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''Time the code in a with block as the phase name. CPU time includes the time of worker processes that have finished during the phase.'''
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        children = getChildrenCpuTime()
+        try:
+            yield
+        finally:
+            phase = {"name": name,
+                     "wall": time.perf_counter() - wall,
+                     "cpu": time.process_time() - cpu}
+            if children != None:
+                phase["cpu_workers"] = getChildrenCpuTime() - children
+            self.phases.append(phase)
+
+    def set(self, key, value):
+        '''Add a value to the report'''
+        self.values[key] = value
+
+    def getReport(self):
+        '''Return the report as a dict'''
+        report = {"phases": self.phases,
+                  "wall": sum(phase["wall"] for phase in self.phases),
+                  "peak_rss": getPeakRss("self"),
+                  "peak_rss_workers": getPeakRss("children")}
+        report.update(self.values)
+        return report
+
+    def write(self, path):
+        '''Write the report to path, or to stderr if path is "-"'''
+        report = json.dumps(self.getReport(), indent=1)
+        if path == "-":
+            print(report, file=sys.stderr)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+
+def getChildrenCpuTime():
+    '''Return the user and system CPU time of finished child processes, or None if it is not available'''
+    if resource == None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def getPeakRss(who="self"):
+    '''Return the peak resident set size in bytes of this process or of its largest finished child process, or None if it is not available'''
+    if resource == None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    if sys.platform == "darwin":
+        return usage.ru_maxrss # reported in bytes on Mac
+    return usage.ru_maxrss * 1024
+
+if __name__ == '__main__':
+    print("Timing and memory instrumentation for tiger-calculator")
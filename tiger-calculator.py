@@ -2,91 +2,150 @@
 
 import sys
 import argparse
+import contextlib
+import json
+import time
+import cache
 import formats
 import os
 import multiprocessing
+import profiling
+import tiger
 
 multiprocessing_allowed = os.name != 'nt' # multiprocessing currently incompatible with Windows, so we disable it here.
-if multiprocessing_allowed:
-    multiprocessing.set_start_method('fork') # multiprocessing fix for Mac Pythons changing the default start method in Python 3.7.
 
 PARSER_DESC = "Simple TIGER rates calculator."
 FORMAT_ERROR_MSG = "Please specify one of the available formats: " + formats.getFormatsAsString()
 N_PROCESSES = int(multiprocessing.cpu_count())
+# Options that only apply to some modes, with a test of whether each one was given
+MODE_OPTION_FLAGS = [("-i", lambda args: args.ignored_chars != ""),
+                     ("-x", lambda args: args.excluded_taxa != ""),
+                     ("-c", lambda args: args.chunk_size != None),
+                     ("-e", lambda args: args.engine != "patterns"),
+                     ("--schedule", lambda args: args.schedule != "dynamic"),
+                     ("--worker-report", lambda args: args.worker_report),
+                     ("--checkpoint", lambda args: args.checkpoint != None),
+                     ("--progress", lambda args: args.progress != None),
+                     ("--shard", lambda args: args.shard != None),
+                     ("--pa-matrix", lambda args: args.pa_matrix != None),
+                     ("--seed", lambda args: args.seed != None),
+                     ("--target-width", lambda args: args.target_width != None),
+                     ("--threshold", lambda args: args.threshold != None),
+                     ("--memory-budget", lambda args: args.memory_budget != tiger.DEFAULT_MEMORY_BUDGET // 2**20),
+                     ("--temp-dir", lambda args: args.temp_dir != None)]
+# The options of MODE_OPTION_FLAGS allowed in each mode. The other modes are named after the option that selects them.
+MODE_OPTIONS = {"default": {"-i", "-x", "-c", "-e", "--schedule", "--worker-report", "--checkpoint", "--progress", "--shard", "--pa-matrix"},
+                "-e blocked": {"-i", "-x", "-e", "--memory-budget", "--temp-dir"},
+                "--replicates": {"-i", "-x", "--seed"},
+                "--jackknife": {"-i", "-x"},
+                "--bootstrap": {"-i", "-x", "--seed"},
+                "--incremental": {"-i", "-x", "-c"},
+                "--approximate": {"-i", "-x", "-c", "--seed", "--target-width", "--threshold"},
+                "--configuration": {"-c"}}
+
+
+def print_rates(rates, names, named_characters):
+    '''Print the TIGER rate of each character, optionally preceded by its name. Each rate can also be a tuple of values, which are printed in tab-separated columns.'''
+    for k in range(len(rates)):
+        line = ""
+        if named_characters:
+            line += str(names[k]) + "\t"
+        if isinstance(rates[k], tuple):
+            line += "\t".join(str(v) for v in rates[k])
+        else:
+            line += str(rates[k])
+        print(line)
+
+
+def format_duration(seconds):
+    '''Format a duration in seconds as h:mm:ss'''
+    seconds = int(round(seconds))
+    return "%i:%02i:%02i" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ProgressReporter(object):
+    '''Print progress to stderr at most once every interval seconds, with an estimate of the remaining time. The first call gives the number of characters finished before this run (from a checkpoint), which do not count toward the speed estimate.'''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = None
+        self.resumed = None
+
+    def __call__(self, finished, total):
+        now = time.perf_counter()
+        if self.resumed == None:
+            self.resumed = finished
+        elif now - self.last < self.interval and finished < total:
+            return
+        self.last = now
+        elapsed = now - self.start
+        line = "Progress: %i/%i characters (%.1f%%), elapsed %s" % (finished, total, 100.0 * finished / total if total else 100.0, format_duration(elapsed))
+        if self.resumed < finished < total:
+            line += ", remaining %s" % format_duration(elapsed / (finished - self.resumed) * (total - finished))
+        print(line, file=sys.stderr)
+
+
+def print_summaries(results, names, named_characters, jackknife=False):
+    '''Print summaries of the TIGER rates of each character over a list of replicate results in [character] format'''
+    summaries = tiger.summarize_replicates(results, len(names), jackknife)
+    for k in range(len(names)):
+        line = ""
+        if named_characters:
+            line += str(names[k]) + "\t"
+        line += "\t".join(str(v) for v in summaries[k])
+        print(line)
+
 
+def parse_configuration(text):
+    '''Parse a configuration of the form IGNORED;EXCLUDED into lists of ignored characters and excluded taxa'''
+    ignored, separator, excluded = text.partition(";")
+    return (ignored.split(","), excluded.split(","))
 
-class ActivePool(object):
-    def __init__(self):
-        super(ActivePool, self).__init__()
-        self.mgr = multiprocessing.Manager()
-        self.active = self.mgr.list()
-        self.result = self.mgr.dict()
-        self.data = self.mgr.dict()
-        self.lock = multiprocessing.Lock()
-
-    def makeActive(self, name):
-        with self.lock:
-            self.active.append(name)
-
-    def makeInactive(self, name):
-        with self.lock:
-            self.active.remove(name)
-
-    def __str__(self):
-        with self.lock:
-            return str(self.active)
-
-
-def split_list(alist, wanted_parts=1):
-    '''Split a list equally into a specified number of parts'''
-    length = len(alist)
-    return [ alist[i*length // wanted_parts: (i+1)*length // wanted_parts] 
-             for i in range(wanted_parts) ]
-
-
-def calculate_tiger_rates(analyzed_keys):
-    '''Calculate partition agreements and TIGER rates for the characters specified by the array keys'''
-    results = {}
-    for x in analyzed_keys:
-        agr_array = []
-        for y in char_dict.keys():
-            if x == y:
-                continue
-            agreements = 0 # numerator of pa(i,j)
-            total = 0      # denominator of pa(i,j). Equal to len(char_dict)-1.
-            valid_taxa = set()
-            for sp_x in set_parts[x]:
-                valid_taxa = valid_taxa|set_parts[x][sp_x] # set of taxa without missing data for site x
-            for sp_y in set_parts[y]:
-                match = False
-                for sp_x in set_parts[x]:
-                    current_x = set_parts[x][sp_x]
-                    current_y = set_parts[y][sp_y]
-                    if current_y.intersection(valid_taxa).issubset(current_x): # Compare taxa in y minus missing taxa in x to taxa in x
-                        match = True
-                        break # Found a match; don't compare the remaining ones
-                total += 1
-                if match:
-                    agreements += 1
-            agr_array.append(float(agreements)/total)
-        # Calculate TIGER rates
-        results[x] = sum(agr_array) / len(agr_array) # TIGER rate for the current character
-    return results
-
-
-def calculate_tiger_rates_multiprocessing(analyzed_keys, pool, s):
-    '''Calculate partition agreements and TIGER rates for the characters specified by the array keys (multiprocessing)'''
-    name = multiprocessing.current_process().name
-    with s:
-        pool.makeActive(name)
-        data = pool.data
-        result = calculate_tiger_rates(analyzed_keys)
-        for k in result.keys():
-            pool.result[k] = result[k]
+
+def parse_shard(text):
+    '''Parse a shard specification of the form K/N'''
+    try:
+        shard, n_shards = (int(value) for value in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be of the form K/N, for example 2/8")
+    if not 1 <= shard <= n_shards:
+        raise argparse.ArgumentTypeError("shard K/N must have 1 <= K <= N")
+    return shard, n_shards
+
+
+def merge(argv):
+    '''Command line of the merge subcommand: validate and combine shard results and print the rates like a normal run'''
+    parser = argparse.ArgumentParser(prog="tiger-calculator.py merge", description="Combine the partial results of runs with --shard into the normal output.")
+    parser.add_argument(dest="shard_files", help="Shard result files.", metavar="SHARD_FILE", nargs="+", type=str)
+    parser.add_argument("-n","--named-characters",
+                        dest="named_characters",
+                        help="Include a column identifying which TIGER rate belongs to which aligned character.",
+                        default=False,
+                        action='store_true')
+    args = parser.parse_args(argv)
+    shards = []
+    for path in args.shard_files:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                shards.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print("Unable to read shard file %s: %s" % (path, e), file=sys.stderr)
+            exit(1)
+    try:
+        names, rates = tiger.merge_shards(shards)
+    except (ValueError, KeyError) as e:
+        print("Unable to merge shards: %s" % e, file=sys.stderr)
+        exit(1)
+    print_rates(rates, names, args.named_characters)
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description=PARSER_DESC)
+    if sys.argv[1:2] == ["merge"]:
+        merge(sys.argv[2:])
+        exit(0)
+
+    parser = argparse.ArgumentParser(description=PARSER_DESC, epilog="Use tiger-calculator.py merge SHARD_FILE... to combine the results of runs with --shard.")
 
     parser.add_argument(dest="in_file",
                         help="Input file to analyze.",
@@ -118,6 +177,138 @@ if __name__ == '__main__':
                         default=N_PROCESSES,
                         type=int)
 
+    parser.add_argument("-c","--chunk-size",
+                        dest="chunk_size",
+                        help="Number of characters each process analyzes at a time when using multiple processes. Default: chunks of roughly equal estimated cost, %i per process." % tiger.CHUNKS_PER_PROCESS,
+                        default=None,
+                        type=int)
+
+    parser.add_argument("--schedule",
+                        dest="schedule",
+                        help="How characters are distributed among processes. Available schedules: dynamic (chunks handed out to free processes, most expensive characters first), balanced (one chunk per process, balanced by estimated cost), static (equal-sized chunks in alignment order). Default: dynamic.",
+                        default="dynamic",
+                        choices=tiger.SCHEDULES,
+                        type=str)
+
+    parser.add_argument("--worker-report",
+                        dest="worker_report",
+                        help="Report the number of characters and busy time of each worker process to stderr.",
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument("--profile",
+                        dest="profile",
+                        help="Report the wall and CPU time of each phase (reading, partitions, rates, output), the peak memory use, the number of partition agreement comparisons and the throughput of each worker as JSON to the specified file, or to stderr if it is -.",
+                        metavar="FILE",
+                        default=None,
+                        type=str)
+
+    parser.add_argument("--cprofile",
+                        dest="cprofile",
+                        help="Write cProfile statistics of the rates phase to the specified file, for viewing with pstats. Only the main process is profiled, so use -p 1 to profile the calculation itself.",
+                        default=None,
+                        type=str)
+
+    parser.add_argument("--checkpoint",
+                        dest="checkpoint",
+                        help="Append the TIGER rates to the specified checkpoint file as chunks of characters finish, so that an interrupted run can be continued with --resume. Use --chunk-size to checkpoint more often when using multiple processes.",
+                        default=None,
+                        type=str)
+
+    parser.add_argument("--resume",
+                        dest="resume",
+                        help="Continue the run in the --checkpoint file, calculating only the characters missing from it. The input and options must be the same as in the interrupted run.",
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument("--progress",
+                        dest="progress",
+                        help="Report progress and the estimated time to completion to stderr, at most once every specified number of seconds.",
+                        metavar="SECONDS",
+                        default=None,
+                        type=float)
+
+    parser.add_argument("--shard",
+                        dest="shard",
+                        help="Calculate the TIGER rates of only shard K of N of the characters (still comparing them against all characters), and print a partial result as JSON. Each shard gets roughly the same amount of work. Combine the shards with the merge subcommand.",
+                        metavar="K/N",
+                        default=None,
+                        type=parse_shard)
+
+    parser.add_argument("--pa-matrix",
+                        dest="pa_matrix",
+                        help="Write the full matrix of partition agreements between characters to the specified file as a float32 .npy array. Rows are written as they are calculated, so the matrix does not need to fit in memory. Use pamatrix.py to query it.",
+                        default=None,
+                        type=str)
+
+    parser.add_argument("--replicates",
+                        dest="replicates",
+                        help="Calculate TIGER rates for the specified number of replicates of the random synonym strategy (CLDF only). Only the meanings with synonyms are resampled. For each character, prints the mean, standard deviation and the 2.5%%, 50%% and 97.5%% quantiles of its TIGER rate.",
+                        default=None,
+                        type=int)
+
+    parser.add_argument("--seed",
+                        dest="seed",
+                        help="Random seed for --replicates, --bootstrap and --approximate.",
+                        default=None,
+                        type=int)
+
+    parser.add_argument("--jackknife",
+                        dest="jackknife",
+                        help="Calculate TIGER rates leaving out each taxon in turn. For each character, prints the mean, jackknife standard error and the 2.5%%, 50%% and 97.5%% quantiles of its TIGER rate.",
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument("--bootstrap",
+                        dest="bootstrap",
+                        help="Calculate TIGER rates for the specified number of bootstrap samples of the taxa. For each character, prints the mean, standard deviation and the 2.5%%, 50%% and 97.5%% quantiles of its TIGER rate.",
+                        default=None,
+                        type=int)
+
+    parser.add_argument("--incremental",
+                        dest="incremental",
+                        help="Keep the partitions and agreement sums of all characters in the specified state file. If the file exists, only the characters that were added or whose partitions changed since it was written are compared against all characters, and the sums of the others are updated. Gives the same rates as the exact engine.",
+                        default=None,
+                        type=str)
+
+    parser.add_argument("--configuration",
+                        dest="configurations",
+                        help="Calculate TIGER rates for a configuration of ignored characters and excluded taxa, given as comma-separated lists like -i and -x separated by a semicolon, e.g. \"?,-;taxon1\". Repeat the option for each configuration. The partitions are built once, and each configuration reuses the partition agreements of the previous ones where its partitions are unchanged. Prints one tab-separated column of rates per configuration, in the order given. Gives the same rates as the exact engine.",
+                        metavar="IGNORED;EXCLUDED",
+                        default=None,
+                        action="append",
+                        type=parse_configuration)
+
+    parser.add_argument("--approximate",
+                        dest="approximate",
+                        help="Estimate the TIGER rate of each character by comparing it against random samples of the specified number of other characters. Prints the estimate, its standard error and the number of characters compared for each character.",
+                        default=None,
+                        type=int)
+
+    parser.add_argument("--target-width",
+                        dest="target_width",
+                        help="With --approximate, keep sampling each character until the 95%% confidence interval of its rate is at most this wide.",
+                        default=None,
+                        type=float)
+
+    parser.add_argument("--threshold",
+                        dest="threshold",
+                        help="With --approximate, keep sampling the characters whose 95%% confidence interval contains this rate until it no longer does.",
+                        default=None,
+                        type=float)
+
+    parser.add_argument("--cache",
+                        dest="cache",
+                        help="Cache the parsed input file next to it, or in the directory given with --cache-dir, and reuse the cache on later runs with the same input and format. Not used with the random synonym strategy.",
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument("--cache-dir",
+                        dest="cache_dir",
+                        help="Directory for cache files. Implies --cache.",
+                        default=None,
+                        type=str)
+
     parser.add_argument("-n","--named-characters",
                         dest="named_characters",
                         help="Include a column identifying which TIGER rate belongs to which aligned character.",
@@ -130,6 +321,25 @@ if __name__ == '__main__':
                         default="minimum",
                         type=str)
 
+    parser.add_argument("-e","--engine",
+                        dest="engine",
+                        help="Engine for calculating partition agreements. Available engines: %s. Default: patterns. The patterns engine computes each unique site pattern only once and gives the same rates as the bitset and sets engines. The exact engine also computes each unique site pattern only once, but rounds the rates exactly, so they may differ from the other engines in the last digit. The blocked engine keeps the partitions in a memory-mapped file and compares them in tiles that fit in --memory-budget, for alignments whose partitions do not fit in memory; it gives the same rates as the exact engine." % ", ".join(tiger.ENGINE_NAMES),
+                        default="patterns",
+                        choices=tiger.ENGINE_NAMES,
+                        type=str)
+
+    parser.add_argument("--memory-budget",
+                        dest="memory_budget",
+                        help="Memory in megabytes for the partitions with the blocked engine, shared by all processes. Default: %i." % (tiger.DEFAULT_MEMORY_BUDGET // 2**20),
+                        default=tiger.DEFAULT_MEMORY_BUDGET // 2**20,
+                        type=float)
+
+    parser.add_argument("--temp-dir",
+                        dest="temp_dir",
+                        help="Directory for the partition file of the blocked engine. Default: the system temporary directory.",
+                        default=None,
+                        type=str)
+
     if len(sys.argv) == 1:
         parser.print_help()
         exit(0)
@@ -138,6 +348,10 @@ if __name__ == '__main__':
         print(FORMAT_ERROR_MSG, file=sys.stderr)
         exit(1)
 
+    if args.chunk_size != None and args.chunk_size < 1:
+        print("Chunk size must be at least 1.", file=sys.stderr)
+        exit(1)
+
     reader = formats.getReader(args.format)
     if args.format == "cldf":
         reader.synonym_strategy = args.synonym_strategy
@@ -146,101 +360,160 @@ if __name__ == '__main__':
         print(FORMAT_ERROR_MSG, file=sys.stderr)
         exit(1)
 
-    content = reader.getContents(args.in_file)
-    taxa = content[0]
-    chars = content[1]
-    try:
-        names = content[2]
-    except:
-        names = range(1, len(chars[0]) + 1)
-
-    excluded_taxa = args.excluded_taxa.split(",")
-    if excluded_taxa != [""]:
-        excluded_taxa = set(excluded_taxa)
-        for taxon in excluded_taxa:
-            if taxon not in taxa:
-                print("Taxon %s not found in data." % taxon, file=sys.stderr)
-                exit(1)
-        while len(excluded_taxa) > 0:
-            for i in range(len(taxa)):
-                if taxa[i] in excluded_taxa:
-                    current_taxon = taxa[i]
-                    excluded_taxa.remove(current_taxon)
-                    del taxa[i]
-                    del chars[i]
-                    break
-
-    ignored_chars = args.ignored_chars.split(",")
-
-    if len(taxa) == 0 or len(chars) == 0:
-        print("Error: Empty characters or taxa in input file.", file=sys.stderr)
+    modes = [mode for mode, given in (("--replicates", args.replicates != None),
+                                      ("--jackknife", args.jackknife),
+                                      ("--bootstrap", args.bootstrap != None),
+                                      ("--incremental", args.incremental != None),
+                                      ("--approximate", args.approximate != None),
+                                      ("--configuration", args.configurations != None)) if given]
+    if len(modes) > 1:
+        print("%s cannot be used together." % " and ".join(modes), file=sys.stderr)
         exit(1)
-
-    # set up a dict with [char_num][taxon] format. Each terminal node contains an aligned character
-
-    char_dict = {}
-    for i in range(len(chars[0])):
-        char_dict[i] = {}
-        for j in range(len(taxa)):
-            char_dict[i][taxa[j]] = chars[j][i]
-
-    # Step 1: collect set partitions
-
-    # set up a dict with [site][char] format, where each terminal node contains a set of taxa
-    set_parts = {}
-    for i in range(len(chars[0])):
-        set_parts[i] = {}
-
-    for site in char_dict.keys():
-        # Collect a set of what chars this site contains. Set up the necessary arrays in set_parts.
-        chars_at_site = set()
-        for taxon in char_dict[site].keys():
-            chars_at_site.add(char_dict[site][taxon])
-        for c in chars_at_site:
-            set_parts[site][c] = set()
-
-        # Determine set partitions: collect a list corresponding to each multistate character
-        for taxon in char_dict[site].keys():
-            content = char_dict[site][taxon]
-            set_parts[site][content].add(taxon)
-
-        # Remove ignored characters from set_parts
-        for c in ignored_chars:
-            removed = set_parts[site].pop(c,None)
-        if set_parts[site] == {}:
-            print("Error: Empty character alignment at position " + str(site) + ". TIGER rates not calculated.", file=sys.stderr)
+    mode = modes[0] if modes else ("-e blocked" if args.engine == "blocked" else "default")
+    for flag, given in MODE_OPTION_FLAGS:
+        if given(args) and flag not in MODE_OPTIONS[mode]:
+            if mode == "default":
+                print("%s can only be used with %s." % (flag, ", ".join(sorted(other for other in MODE_OPTIONS.keys() if flag in MODE_OPTIONS[other]))), file=sys.stderr)
+            else:
+                print("%s cannot be used with %s." % (flag, mode), file=sys.stderr)
             exit(1)
+    if args.approximate != None and args.approximate < 2:
+        print("The sample size of --approximate must be at least 2.", file=sys.stderr)
+        exit(1)
+    if args.resume and args.checkpoint == None:
+        print("--resume requires --checkpoint.", file=sys.stderr)
+        exit(1)
+    if args.shard != None and args.pa_matrix != None:
+        print("--shard cannot be used with --pa-matrix.", file=sys.stderr)
+        exit(1)
+    if args.bootstrap != None and args.bootstrap < 2:
+        print("At least 2 bootstrap samples are needed.", file=sys.stderr)
+        exit(1)
 
-    # Steps 2 and 3: calculate partition agreements and TIGER rates
-
-    result = None
-
-    # multiprocessing
-    if not multiprocessing_allowed and args.n_processes > 1:
+    n_processes = args.n_processes
+    if not multiprocessing_allowed and n_processes > 1:
         print("Multiprocessing disabled for current system", file=sys.stderr)
+        n_processes = 1
+    ignored_chars = args.ignored_chars.split(",")
+    excluded_taxa = args.excluded_taxa.split(",")
 
-    if args.n_processes > 1 and multiprocessing_allowed:
-        pool = ActivePool()
-        pool.data.update(char_dict)
-        s = multiprocessing.Semaphore(args.n_processes)
-        jobs = [ multiprocessing.Process(target=calculate_tiger_rates_multiprocessing, name=str(k), args=(k, pool, s))
-              for k in split_list(list(char_dict.keys()),args.n_processes)]
-
-        for j in jobs:
-          j.start()
-
-        for j in jobs:
-          j.join()
-
-        result = pool.result
+    profile = profiling.Profile()
+    profiler = None
+    if args.cprofile != None:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    @contextlib.contextmanager
+    def rates_phase():
+        '''Time the calculation, and profile it if requested'''
+        with profile.phase("rates"):
+            if profiler != None:
+                profiler.enable()
+            try:
+                yield
+            finally:
+                if profiler != None:
+                    profiler.disable()
 
-    # single-threaded
-    else:
-        result = calculate_tiger_rates(char_dict.keys())
+    try:
+        if args.replicates != None:
+            # Replicate mode: read the cognates once, and resample only the meanings with synonyms
+            if args.format != "cldf" or args.synonym_strategy != "random":
+                print("Replicates can only be calculated for CLDF datasets with the random synonym strategy.", file=sys.stderr)
+                exit(1)
+            if args.replicates < 2:
+                print("At least 2 replicates are needed.", file=sys.stderr)
+                exit(1)
+            with profile.phase("read"):
+                cognate_data = reader.readCognates(args.in_file)
+            with rates_phase():
+                results = tiger.replicate_rates(cognate_data, args.replicates, ignored_chars, excluded_taxa, args.seed, n_processes)
+            with profile.phase("output"):
+                print_summaries(results, cognate_data[1], args.named_characters)
+        else:
+            with profile.phase("read"):
+                reader_options = {"synonym_strategy": args.synonym_strategy} if args.format == "cldf" else {}
+                use_cache = (args.cache or args.cache_dir != None) and reader_options.get("synonym_strategy") != "random"
+                content = None
+                if use_cache and os.path.exists(args.in_file):
+                    cache_file = cache.getCachePath(args.in_file, args.format, reader_options, args.cache_dir)
+                    cache_key = cache.getCacheKey(args.in_file, args.format, reader_options)
+                    content = cache.loadCache(cache_file, cache_key)
+                if content == None:
+                    content = reader.getEncodedContents(args.in_file)
+                    if use_cache:
+                        cache.saveCache(cache_file, cache_key, content)
+
+            if args.configurations != None:
+                # Multi-configuration mode: derive the partitions of each configuration from one set of unmasked partitions
+                with rates_phase():
+                    results = tiger.multi_rates(content, args.configurations, n_processes, args.chunk_size)
+                names = content.names if content.names != None else range(1, content.n_sites + 1)
+                with profile.phase("output"):
+                    print_rates([tuple(rates[site] for rates in results) for site in range(content.n_sites)], names, args.named_characters)
+            elif args.engine == "blocked":
+                # Out-of-core calculation: the partitions are written to a file and never built in memory together
+                with rates_phase():
+                    rates = tiger.blocked_rates(content, ignored_chars=ignored_chars, excluded_taxa=excluded_taxa, memory_budget=args.memory_budget * 2**20, n_processes=n_processes, temp_dir=args.temp_dir)
+                names = content.names if content.names != None else range(1, content.n_sites + 1)
+                with profile.phase("output"):
+                    print_rates(rates, names, args.named_characters)
+            else:
+                # Step 1: collect set partitions
+                with profile.phase("partitions"):
+                    partitions = tiger.Partitions(content, ignored_chars=ignored_chars, excluded_taxa=excluded_taxa)
+                    names = partitions.names
+                profile.set("taxa", len(partitions.taxa))
+                profile.set("characters", partitions.n_sites)
+                profile.set("patterns", len(partitions.pattern_weights))
+
+                if args.jackknife or args.bootstrap != None:
+                    with rates_phase():
+                        if args.jackknife:
+                            results = tiger.jackknife_rates(partitions, n_processes)
+                        else:
+                            results = tiger.bootstrap_rates(partitions, args.bootstrap, args.seed, n_processes)
+                    with profile.phase("output"):
+                        print_summaries(results, names, args.named_characters, args.jackknife)
+                elif args.approximate != None:
+                    # Approximate mode: estimate the rates from random samples of the other characters
+                    with rates_phase():
+                        estimates = tiger.approximate_rates(partitions, args.approximate, args.target_width, args.threshold, args.seed, n_processes, args.chunk_size)
+                    profile.set("comparisons", sum(estimate[2] for estimate in estimates))
+                    with profile.phase("output"):
+                        print_rates(estimates, names, args.named_characters)
+                elif args.incremental != None:
+                    # Incremental mode: reuse the agreement sums of characters whose partitions have not changed since the previous run
+                    with rates_phase():
+                        rates = tiger.incremental_rates(partitions, args.incremental, n_processes, args.chunk_size)
+                    with profile.phase("output"):
+                        print_rates(rates, names, args.named_characters)
+                else:
+                    # Steps 2 and 3: calculate partition agreements and TIGER rates
+                    workers = {}
+                    sites = tiger.shard_sites(partitions, args.shard[0], args.shard[1], args.engine) if args.shard != None else None
+                    with rates_phase():
+                        rates = tiger.tiger_rates(partitions, engine=args.engine, n_processes=n_processes, chunk_size=args.chunk_size, schedule=args.schedule, pa_file=args.pa_matrix, worker_times=workers, checkpoint=args.checkpoint, resume=args.resume, progress=ProgressReporter(args.progress) if args.progress != None else None, sites=sites)
+                    if args.worker_report:
+                        for pid in sorted(workers.keys()):
+                            print("Worker %i: %i characters, busy %.3f s" % (pid, workers[pid][0], workers[pid][1]), file=sys.stderr)
+                    profile.set("comparisons", tiger.count_comparisons(partitions, args.engine, sites))
+                    profile.set("workers", [{"pid": pid,
+                                             "characters": workers[pid][0],
+                                             "busy": workers[pid][1],
+                                             "characters_per_second": workers[pid][0] / workers[pid][1] if workers[pid][1] > 0 else None} for pid in sorted(workers.keys())])
+                    # Time spent outside the busiest worker: process start-up, scheduling and collecting results
+                    profile.set("pool_overhead", profile.phases[-1]["wall"] - max(worker[1] for worker in workers.values()))
+                    with profile.phase("output"):
+                        if args.shard != None:
+                            print(json.dumps(tiger.shard_result(partitions, rates, args.shard[0], args.shard[1], args.engine)))
+                        else:
+                            print_rates(rates, names, args.named_characters)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
 
-    for k in sorted(result.keys()):
-        line = ""
-        if args.named_characters:
-            line += str(names[k]) + "\t"
-        line += str(result[k])
-        print(line)
+    if args.profile != None:
+        profile.write(args.profile)
+    if profiler != None:
+        profiler.dump_stats(args.cprofile)
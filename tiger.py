@@ -0,0 +1,1016 @@
+#!/usr/bin/python3
+
+'''Library interface of tiger-calculator.
+
+The TIGER rate calculation can be used without the command line program:
+
+    import tiger
+    rates = tiger.tiger_rates(["0110", "0100", "1?11"], taxa=["a", "b", "c"], ignored_chars=["?"])
+
+Alignments can be given as reader output (an Alignment from getEncodedContents of a reader returned by
+formats.getReader, or read_alignment), or as a list of sequences or a 2-D NumPy array of states with one row per
+taxon, in which case the taxon names are given with taxa (by default the row numbers). Building the Partitions of an alignment once and passing them to
+several functions avoids repeating the work.'''
+
+import array
+import concurrent.futures
+import fractions
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from alignment import Alignment
+
+CHUNKS_PER_PROCESS = 4
+PA_MATRIX_CHUNK_SIZE = 256 # characters per chunk when a single process writes pa(i,j) rows or checkpoints
+CHECKPOINT_MAGIC = "TIGERCHECKPOINT1"
+DEFAULT_MEMORY_BUDGET = 512 * 2**20 # bytes of decoded partitions per run with the blocked engine
+SCHEDULES = ["dynamic", "balanced", "static"]
+CONFIDENCE_Z = 1.959963984540054 # 95% confidence intervals
+
+
+def read_alignment(in_file, format, synonym_strategy="minimum"):
+    '''Read an input file with the reader of the specified format. Returns the contents in the form returned by getEncodedContents.'''
+    import formats
+    reader = formats.getReader(format)
+    if reader == None:
+        raise ValueError("Please specify one of the available formats: " + formats.getFormatsAsString())
+    if format == "cldf":
+        reader.synonym_strategy = synonym_strategy
+    return reader.getEncodedContents(in_file)
+
+
+def encode_alignment(alignment, taxa=None, names=None):
+    '''Return an alignment as an Alignment object (see alignment.py). alignment is either an Alignment, as returned by the getEncodedContents method of the readers, or a list of sequences or a 2-D NumPy array with one row of states per taxon. Sequences without taxon names get the row numbers as names. Contents in the form returned by getContents can be converted with absreader.encodeContents.'''
+    import absreader
+    if isinstance(alignment, Alignment):
+        return alignment
+    if hasattr(alignment, "tolist"):
+        alignment = alignment.tolist()
+    if taxa == None:
+        taxa = [str(i) for i in range(len(alignment))]
+    content = absreader.encodeContents([list(taxa), alignment])
+    content.names = names
+    return content
+
+
+class Partitions(object):
+    '''Set partitions of the characters of an alignment. bit_parts is a dict with [site] format, where each terminal node is a tuple of (bitmasks of the states at site, bitmask of taxa without missing data at site). Bit j of the bitmasks stands for the j-th taxon in taxa, which leaves out the excluded taxa. Sites with identical partitions are grouped into patterns: representatives points from each site to the first site of its pattern, pattern_weights gives the number of sites of each pattern, and pattern_members lists the sites of each pattern. set_parts is a dict with [site][char] format, where each terminal node contains a set of taxa; it is only built when first used, by the sets engine.'''
+
+    def __init__(self, alignment, taxa=None, names=None, ignored_chars=(), excluded_taxa=()):
+        alignment = encode_alignment(alignment, taxa, names)
+        n_sites = alignment.n_sites
+        names = alignment.names
+        if names == None:
+            names = range(1, n_sites + 1)
+
+        # Excluded taxa and ignored characters are applied as masks while building the partitions of each column
+        taxon_flags = alignment.getTaxonFlags(excluded_taxa)
+        missing_codes = alignment.getMissingCodes(ignored_chars)
+        taxa = list(alignment.taxa if taxon_flags == None else itertools.compress(alignment.taxa, taxon_flags))
+
+        if len(taxa) == 0 or n_sites == 0:
+            raise ValueError("Error: Empty characters or taxa in input file.")
+
+        bit_parts = {}
+        for site in range(n_sites):
+            masks = tuple(mask for code, mask in alignment.getSiteMasks(site, missing_codes, taxon_flags))
+            if masks == ():
+                raise ValueError("Error: Empty character alignment at position " + str(site) + ". TIGER rates not calculated.")
+            valid = 0
+            for mask in masks:
+                valid |= mask
+            bit_parts[site] = (masks, valid)
+
+        self.alignment = alignment
+        self.taxon_flags = taxon_flags
+        self.missing_codes = missing_codes
+        self.taxa = taxa
+        self.names = names
+        self.n_sites = n_sites
+        self.bit_parts = bit_parts
+        self._set_parts = None
+        # Sites with identical partitions have identical TIGER rates
+        self.representatives, self.pattern_weights = site_patterns(self.bit_parts)
+        self.pattern_members = {}
+        for site in self.representatives.keys():
+            self.pattern_members.setdefault(self.representatives[site], []).append(site)
+
+    @property
+    def set_parts(self):
+        if self._set_parts == None:
+            states = self.alignment.states
+            set_parts = {}
+            for site in range(self.n_sites):
+                set_parts[site] = {}
+                for code, mask in self.alignment.getSiteMasks(site, self.missing_codes, self.taxon_flags):
+                    set_parts[site][states[code]] = {self.taxa[j] for j in range(len(self.taxa)) if mask >> j & 1}
+            self._set_parts = set_parts
+        return self._set_parts
+
+
+def get_partitions(alignment, taxa=None, names=None, ignored_chars=(), excluded_taxa=()):
+    '''Return alignment if it already is a Partitions object, and otherwise build its partitions'''
+    if isinstance(alignment, Partitions):
+        return alignment
+    return Partitions(alignment, taxa, names, ignored_chars, excluded_taxa)
+
+
+def site_patterns(bit_parts):
+    '''Group sites whose set partitions are identical once state labels are ignored. Returns a dict with [site] format pointing to the first site with the same partition, and a dict with [first_site] format giving the number of sites sharing each partition'''
+    first_sites = {}
+    representatives = {}
+    weights = {}
+    for site in bit_parts.keys():
+        pattern = tuple(sorted(bit_parts[site][0]))
+        first = first_sites.setdefault(pattern, site)
+        representatives[site] = first
+        weights[first] = weights.get(first, 0) + 1
+    return representatives, weights
+
+
+def split_chunks(alist, chunk_size=1):
+    '''Split a list into consecutive parts of at most chunk_size items'''
+    return [ alist[i:i+chunk_size] for i in range(0, len(alist), chunk_size) ]
+
+
+def split_by_cost(alist, costs, wanted_parts=1):
+    '''Split a list into consecutive parts of roughly equal total cost'''
+    target = sum(costs[k] for k in alist) / wanted_parts
+    parts = [[]]
+    part_cost = 0
+    for k in alist:
+        if part_cost >= target and len(parts) < wanted_parts:
+            parts.append([])
+            part_cost = 0
+        parts[-1].append(k)
+        part_cost += costs[k]
+    return parts
+
+
+def balance_list(alist, costs, wanted_parts=1):
+    '''Split a list into a specified number of parts with roughly equal total costs, assigning the most expensive items first to the least loaded part'''
+    parts = [[] for i in range(wanted_parts)]
+    loads = [(0, i) for i in range(wanted_parts)]
+    for k in sorted(alist, key=lambda k: costs[k], reverse=True):
+        load, i = heapq.heappop(loads)
+        parts[i].append(k)
+        heapq.heappush(loads, (load + costs[k], i))
+    return [sorted(part) for part in parts if part]
+
+
+def estimate_costs(partitions, analyzed_keys, compared_keys):
+    '''Estimate the relative cost of analyzing each character: the number of its states times the number of states it is compared against'''
+    bit_parts = partitions.bit_parts
+    compared_states = sum(len(bit_parts[y][0]) for y in compared_keys)
+    return {x: len(bit_parts[x][0]) * compared_states for x in analyzed_keys}
+
+
+def calculate_tiger_rates(partitions, analyzed_keys, rows=None):
+    '''Calculate partition agreements and TIGER rates for the characters specified by the array keys. If rows is a dict, the pa(i,j) values of each character against all characters are stored in it as float arrays.'''
+    set_parts = partitions.set_parts
+    results = {}
+    for x in analyzed_keys:
+        agr_array = []
+        for y in set_parts.keys():
+            if x == y:
+                continue
+            agreements = 0 # numerator of pa(i,j)
+            total = 0      # denominator of pa(i,j). Equal to the number of states of y.
+            valid_taxa = set()
+            for sp_x in set_parts[x]:
+                valid_taxa = valid_taxa|set_parts[x][sp_x] # set of taxa without missing data for site x
+            for sp_y in set_parts[y]:
+                match = False
+                for sp_x in set_parts[x]:
+                    current_x = set_parts[x][sp_x]
+                    current_y = set_parts[y][sp_y]
+                    if current_y.intersection(valid_taxa).issubset(current_x): # Compare taxa in y minus missing taxa in x to taxa in x
+                        match = True
+                        break # Found a match; don't compare the remaining ones
+                total += 1
+                if match:
+                    agreements += 1
+            agr_array.append(float(agreements)/total)
+        # Calculate TIGER rates
+        results[x] = sum(agr_array) / len(agr_array) # TIGER rate for the current character
+        if rows != None:
+            rows[x] = array.array("f", agr_array)
+            rows[x].insert(x, 1.0) # pa(i,i)
+    return results
+
+
+def calculate_tiger_rates_bitset(partitions, analyzed_keys, rows=None):
+    '''Calculate partition agreements and TIGER rates for the characters specified by the array keys, using the bitmasks in bit_parts. Gives the same results as calculate_tiger_rates.'''
+    bit_parts = partitions.bit_parts
+    sites = list(bit_parts.keys())
+    compared_masks = [bit_parts[y][0] for y in sites]
+    results = {}
+    for x in analyzed_keys:
+        agreements = partition_agreements(bit_parts[x], compared_masks) # numerators of pa(i,j)
+        agr_array = [float(agreements[j])/len(compared_masks[j]) for j in range(len(sites)) if sites[j] != x]
+        # Calculate TIGER rates
+        results[x] = sum(agr_array) / len(agr_array) # TIGER rate for the current character
+        if rows != None:
+            rows[x] = array.array("f", agr_array)
+            rows[x].insert(x, 1.0) # pa(i,i)
+    return results
+
+
+def calculate_tiger_rates_patterns(partitions, analyzed_keys, rows=None):
+    '''Calculate partition agreements and TIGER rates for the characters specified by the array keys, comparing each character only once against every unique site pattern in pattern_weights. The pa(i,j) of the patterns are then summed over the other characters in alignment order, so the rates are identical to those of calculate_tiger_rates.'''
+    bit_parts = partitions.bit_parts
+    patterns = list(partitions.pattern_weights.keys())
+    compared_masks = [bit_parts[y][0] for y in patterns]
+    pattern_index = {patterns[j]: j for j in range(len(patterns))}
+    sites = list(bit_parts.keys())
+    site_patterns = [pattern_index[partitions.representatives[y]] for y in sites] # index of the pattern of each site in patterns
+    results = {}
+    for x in analyzed_keys:
+        agreements = partition_agreements(bit_parts[x], compared_masks) # numerators of pa(i,j)
+        pa_patterns = [float(agreements[j])/len(compared_masks[j]) for j in range(len(patterns))]
+        # Calculate TIGER rates
+        results[x] = sum(pa_patterns[site_patterns[j]] for j in range(len(sites)) if sites[j] != x) / (len(sites) - 1) # TIGER rate for the current character
+        if rows != None:
+            rows[x] = array.array("f", (pa_patterns[j] for j in site_patterns)) # pa(i,i) = 1 with its own pattern
+    return results
+
+
+def calculate_tiger_rates_exact(partitions, analyzed_keys, rows=None):
+    '''Calculate partition agreements and TIGER rates for the characters specified by the array keys, comparing each character only once against every unique site pattern in pattern_weights. The weighted sums of pa(i,j) are kept as exact fractions, so the rates are correctly rounded and may differ from those of calculate_tiger_rates in the last digit.'''
+    bit_parts = partitions.bit_parts
+    pattern_weights = partitions.pattern_weights
+    patterns = list(pattern_weights.keys())
+    compared_masks = [bit_parts[y][0] for y in patterns]
+    results = {}
+    for x in analyzed_keys:
+        sums = {} # [denominator] format, each terminal node contains the weighted sum of numerators of pa(i,j)
+        pa_row = {}
+        agreements = partition_agreements(bit_parts[x], compared_masks)
+        for j in range(len(patterns)):
+            total = len(compared_masks[j]) # denominator of pa(i,j)
+            sums[total] = sums.get(total, 0) + pattern_weights[patterns[j]] * agreements[j]
+            pa_row[patterns[j]] = float(agreements[j])/total
+        masks_x = bit_parts[x][0]
+        sums[len(masks_x)] -= len(masks_x) # x was compared against itself with pa(i,i) = 1
+        # Calculate TIGER rates
+        agr_sum = sum(fractions.Fraction(sums[total], total) for total in sums.keys())
+        results[x] = float(agr_sum / (len(bit_parts) - 1)) # TIGER rate for the current character
+        if rows != None:
+            rows[x] = array.array("f", (pa_row[partitions.representatives[y]] for y in partitions.representatives.keys()))
+    return results
+
+
+ENGINES = {"patterns": calculate_tiger_rates_patterns,
+           "exact": calculate_tiger_rates_exact,
+           "bitset": calculate_tiger_rates_bitset,
+           "sets": calculate_tiger_rates}
+# Engines that only analyze the first site of each pattern
+PATTERN_ENGINES = ["patterns", "exact"]
+# All engines: those of tiger_rates, and the out-of-core engine of blocked_rates
+ENGINE_NAMES = list(ENGINES.keys()) + ["blocked"]
+
+
+def partition_agreements(part_x, compared_masks):
+    '''Compare a partition in Partitions.bit_parts format against a list of bitmasks of states of other partitions. Returns a list of the numerators of pa(i,j)'''
+    masks_x, valid_x = part_x
+    results = []
+    for masks_y in compared_masks:
+        agreements = 0 # numerator of pa(i,j)
+        for current_y in masks_y:
+            current_y &= valid_x # taxa in y minus missing taxa in x
+            for current_x in masks_x:
+                if current_y & ~current_x == 0: # current_y is a subset of current_x
+                    agreements += 1
+                    break
+        results.append(agreements)
+    return results
+
+
+def agreement_sums(part_x, compared_parts):
+    '''Compare a partition in Partitions.bit_parts format against a list of (bitmasks of states, weight) pairs. Returns a dict with [denominator] format, where each terminal node contains the weighted sum of numerators of pa(i,j)'''
+    sums = {}
+    agreements = partition_agreements(part_x, [masks_y for masks_y, weight in compared_parts])
+    for i in range(len(compared_parts)):
+        masks_y, weight = compared_parts[i]
+        total = len(masks_y) # denominator of pa(i,j)
+        sums[total] = sums.get(total, 0) + weight * agreements[i]
+    return sums
+
+
+def add_sums(sums, other):
+    '''Add the agreement sums in other to sums'''
+    for total in other.keys():
+        sums[total] = sums.get(total, 0) + other[total]
+    return sums
+
+
+def sums_to_rate(sums, n_compared):
+    '''Return the TIGER rate of a character from its agreement sums and the number of characters it was compared against'''
+    return float(sum(fractions.Fraction(sums[total], total) for total in sums.keys()) / n_compared)
+
+
+# Data shared with the worker processes of a pool. Set once in each worker by _init_worker.
+_worker_data = None
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _call_worker(function, *args):
+    '''Call function with the data shared with the worker processes and args'''
+    return function(_worker_data, *args)
+
+
+def process_pool(data, n_processes):
+    '''Start a pool of n_processes worker processes sharing data. Where possible the workers are forked, so they inherit the data without it being pickled. Submit calls to it as pool.submit(_call_worker, function, *args), which calls function(data, *args) in a worker.'''
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    return concurrent.futures.ProcessPoolExecutor(max_workers=n_processes, mp_context=context, initializer=_init_worker, initargs=(data,))
+
+
+def map_items(function, data, items, n_processes=1, chunk_size=None):
+    '''Return [function(data, item) for item in items], calculated in a pool of n_processes worker processes if n_processes is greater than 1'''
+    items = list(items)
+    if n_processes <= 1:
+        return [function(data, item) for item in items]
+    if chunk_size == None:
+        chunk_size = max(1, len(items) // (n_processes * CHUNKS_PER_PROCESS))
+    with process_pool(data, n_processes) as executor:
+        return list(executor.map(_call_worker, itertools.repeat(function), items, chunksize=chunk_size))
+
+
+def write_pa_rows(partitions, pa_file, rows):
+    '''Write the pa(i,j) rows of the analyzed characters to the agreement matrix file, also for all sites sharing their pattern'''
+    import pamatrix
+    site_rows = {}
+    for x in rows.keys():
+        for site in partitions.pattern_members.get(x, [x]):
+            site_rows[site] = rows[x]
+    pamatrix.writeRows(pa_file, site_rows)
+
+
+def calculate_tiger_rates_timed(partitions, analyzed_keys, engine, pa_file=None, keep_rows=False):
+    '''Calculate TIGER rates for the characters specified by the array keys, writing their pa(i,j) rows to pa_file if given. Returns the id of the current process, the time spent, the results and the pa(i,j) rows if keep_rows is set'''
+    start = time.perf_counter()
+    rows = {} if pa_file != None or keep_rows else None
+    results = ENGINES[engine](partitions, analyzed_keys, rows)
+    if pa_file != None:
+        write_pa_rows(partitions, pa_file, rows)
+    return os.getpid(), time.perf_counter() - start, results, rows if keep_rows else None
+
+
+def calculate_tiger_rates_multiprocessing(partitions, analyzed_keys, engine, n_processes, chunk_size=None, schedule="dynamic", costs=None, pa_file=None, keep_rows=False, on_result=None):
+    '''Calculate partition agreements and TIGER rates for the characters specified by the array keys in a pool of worker processes (multiprocessing). The forked workers inherit the partition data read-only, and return the results for each chunk in a single message.
+
+    With the dynamic schedule the characters are handed out in chunks of decreasing estimated cost as workers become free, the balanced schedule gives each process a single chunk of roughly equal total cost, and the static schedule hands out chunks of equal size in the original order. If pa_file is given, each worker writes the pa(i,j) rows of its chunk to it. If on_result is given, it is called with the results of each chunk as soon as the chunk is finished. Returns the results, the pa(i,j) rows if keep_rows is set, and a dict with [process_id] format, where each terminal node is a list of [number of characters, busy time in seconds].'''
+    if costs == None:
+        costs = {k: 1 for k in analyzed_keys}
+    if schedule == "balanced":
+        chunks = balance_list(analyzed_keys, costs, n_processes)
+    elif chunk_size != None:
+        if schedule == "dynamic":
+            analyzed_keys = sorted(analyzed_keys, key=lambda k: costs[k], reverse=True)
+        chunks = split_chunks(analyzed_keys, chunk_size)
+    elif schedule == "dynamic":
+        analyzed_keys = sorted(analyzed_keys, key=lambda k: costs[k], reverse=True)
+        chunks = split_by_cost(analyzed_keys, costs, n_processes * CHUNKS_PER_PROCESS)
+    else:
+        chunks = split_chunks(analyzed_keys, max(1, len(analyzed_keys) // (n_processes * CHUNKS_PER_PROCESS)))
+    results = {}
+    rows = {} if keep_rows else None
+    workers = {}
+    with process_pool(partitions, n_processes) as executor:
+        jobs = [executor.submit(_call_worker, calculate_tiger_rates_timed, chunk, engine, pa_file, keep_rows) for chunk in chunks]
+        for job in concurrent.futures.as_completed(jobs):
+            pid, busy, result, result_rows = job.result()
+            results.update(result)
+            if on_result != None:
+                on_result(result)
+            if keep_rows:
+                rows.update(result_rows)
+            worker = workers.setdefault(pid, [0, 0.0])
+            worker[0] += len(result)
+            worker[1] += busy
+    return results, rows, workers
+
+
+def calculate_block(data, block):
+    '''Calculate the TIGER rates of a block of sites of the partition file in data (see blocked_rates)'''
+    import blocked
+    path, block_size, n_sites = data
+    start, stop = block
+    sums = blocked.calculateBlockSums(path, start, stop, block_size)
+    return [sums_to_rate(site_sums, n_sites - 1) for site_sums in sums]
+
+
+def blocked_rates(alignment, taxa=None, names=None, ignored_chars=(), excluded_taxa=(), memory_budget=DEFAULT_MEMORY_BUDGET, n_processes=1, temp_dir=None):
+    '''Calculate the TIGER rates of all characters of an alignment (see encode_alignment) out of core. The partitions are written site by site to a memory-mapped file in temp_dir, and every block of sites is compared against all sites in tiles sized so that the decoded partitions of each process stay within its share of memory_budget bytes. The agreement sums are exact, so the rates are identical to those of the exact engine. Returns a list of rates in alignment order.'''
+    import blocked
+    import tempfile
+    alignment = encode_alignment(alignment, taxa, names)
+    taxon_flags = alignment.getTaxonFlags(excluded_taxa)
+    if len(alignment.taxa) == 0 or alignment.n_sites == 0 or (taxon_flags != None and not any(taxon_flags)):
+        raise ValueError("Error: Empty characters or taxa in input file.")
+    n_sites = alignment.n_sites
+    with tempfile.TemporaryDirectory(prefix="tiger-", dir=temp_dir) as directory:
+        path = os.path.join(directory, "partitions")
+        blocked.writePartitionFile(path, alignment, alignment.getMissingCodes(ignored_chars), taxon_flags)
+        partition_file = blocked.PartitionFile(path)
+        block_size = partition_file.getBlockSize(memory_budget / max(1, n_processes))
+        partition_file.close()
+        row_size = block_size
+        if n_processes > 1:
+            # Smaller blocks of analyzed sites, so that every process gets work
+            row_size = max(1, min(block_size, -(-n_sites // (n_processes * CHUNKS_PER_PROCESS))))
+        blocks = [(start, min(n_sites, start + row_size)) for start in range(0, n_sites, row_size)]
+        rates = []
+        for block_rates in map_items(calculate_block, (path, block_size, n_sites), blocks, n_processes, 1):
+            rates.extend(block_rates)
+    return rates
+
+
+def partitions_key(partitions, engine):
+    '''Return a key identifying the partitions and engine of a calculation, so that checkpoints and shards are only combined for the same input and options'''
+    description = json.dumps([partitions.taxa, [sorted(partitions.bit_parts[site][0]) for site in range(partitions.n_sites)], engine])
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+def open_checkpoint(path, key, resume=False):
+    '''Open a checkpoint file for appending results. If resume is set and the file exists, returns the results it contains with the open file; otherwise the file is started anew. Each result is a complete line, so a line cut short by an interruption (and anything after it) is discarded and overwritten. Raises ValueError if the file was written for a different key.'''
+    results = {}
+    if resume and os.path.exists(path):
+        f = open(path, "r+b")
+        header = f.readline().decode("utf-8", "replace").split()
+        if header != [CHECKPOINT_MAGIC, key]:
+            f.close()
+            raise ValueError("Checkpoint file %s was written for different input or options." % path)
+        end = f.tell()
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError
+                site, rate = line.decode("ascii").split("\t")
+                results[int(site)] = float(rate)
+            except ValueError:
+                break
+            end += len(line)
+        f.seek(end)
+        f.truncate()
+        return f, results
+    f = open(path, "wb")
+    f.write(("%s %s\n" % (CHECKPOINT_MAGIC, key)).encode("ascii"))
+    f.flush()
+    os.fsync(f.fileno())
+    return f, results
+
+
+def write_checkpoint(f, results):
+    '''Append results with [site] format to an open checkpoint file and make sure they reach the disk'''
+    f.write("".join("%i\t%r\n" % (site, results[site]) for site in sorted(results.keys())).encode("ascii"))
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def count_comparisons(partitions, engine="patterns", sites=None):
+    '''Return the number of pa(i,j) comparisons the engine makes when calculating the TIGER rates of all characters, or of the specified sites'''
+    if engine in PATTERN_ENGINES:
+        n_analyzed = len(partitions.pattern_weights) if sites == None else len(set(partitions.representatives[site] for site in sites))
+        return n_analyzed * len(partitions.pattern_weights)
+    n_analyzed = partitions.n_sites if sites == None else len(sites)
+    return n_analyzed * (partitions.n_sites - 1)
+
+
+def tiger_rates(alignment, taxa=None, names=None, ignored_chars=(), excluded_taxa=(), engine="patterns", n_processes=1, chunk_size=None, schedule="dynamic", pa_rows=False, pa_file=None, worker_times=None, checkpoint=None, resume=False, progress=None, sites=None):
+    '''Calculate the TIGER rates of all characters of an alignment (see encode_alignment) or Partitions object. Returns a list of rates in alignment order, or a tuple of the rates and a list of the pa(i,j) rows of each character as float arrays if pa_rows is set.
+
+    If pa_file is given, the full matrix of pa(i,j) values is written to it (see pamatrix). With n_processes greater than 1 the characters are distributed among worker processes in chunks of chunk_size characters according to schedule (see calculate_tiger_rates_multiprocessing), and if worker_times is a dict, the number of characters and busy time of each worker (or of the current process) are stored in it.
+
+    If checkpoint is given, the rates are appended to that file as chunks of characters finish. With resume set, the characters already in the checkpoint file are not calculated again, provided that it was written for the same partitions and engine. If progress is given, it is called with the number of characters finished and the total number of characters analyzed at the start (counting the resumed ones as finished) and after each chunk. With the patterns and exact engines, a finished pattern counts as all of its characters.
+
+    If sites is given, only the rates of those sites are calculated (against all characters), and the rates of the other sites are None in the returned list.'''
+    partitions = get_partitions(alignment, taxa, names, ignored_chars, excluded_taxa)
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine %s. Available engines: %s." % (engine, ", ".join(ENGINES.keys())))
+    if schedule not in SCHEDULES:
+        raise ValueError("Unknown schedule %s. Available schedules: %s." % (schedule, ", ".join(SCHEDULES)))
+
+    analyzed_keys = list(partitions.bit_parts.keys())
+    if engine in PATTERN_ENGINES:
+        # Only the first site of each pattern is analyzed
+        analyzed_keys = list(partitions.pattern_weights.keys())
+    if sites != None:
+        selected = set(partitions.representatives[site] if engine in PATTERN_ENGINES else site for site in sites)
+        analyzed_keys = [x for x in analyzed_keys if x in selected]
+        if pa_rows:
+            raise ValueError("The pa(i,j) rows can only be returned for all sites.")
+
+    previous = {}
+    checkpoint_file = None
+    if checkpoint != None:
+        if pa_rows:
+            raise ValueError("The pa(i,j) rows cannot be returned when checkpointing.")
+        checkpoint_file, previous = open_checkpoint(checkpoint, partitions_key(partitions, engine), resume)
+    # Number of characters whose rate each analyzed key gives, to report progress in characters
+    if engine in PATTERN_ENGINES:
+        selected_sites = set(sites) if sites != None else None
+        weights = {x: len([y for y in partitions.pattern_members[x] if selected_sites == None or y in selected_sites]) for x in analyzed_keys}
+    else:
+        weights = dict.fromkeys(analyzed_keys, 1)
+    n_total = sum(weights.values())
+    n_finished = [sum(weights[x] for x in analyzed_keys if x in previous)]
+    analyzed_keys = [x for x in analyzed_keys if x not in previous]
+    if progress != None:
+        progress(n_finished[0], n_total)
+
+    def on_result(chunk_result):
+        if checkpoint_file != None:
+            write_checkpoint(checkpoint_file, chunk_result)
+        if progress != None:
+            n_finished[0] += sum(weights[x] for x in chunk_result.keys())
+            progress(n_finished[0], n_total)
+
+    try:
+        if pa_file != None:
+            import pamatrix
+            if not previous:
+                pamatrix.createMatrix(pa_file, partitions.n_sites)
+            elif not os.path.exists(pa_file):
+                raise ValueError("The partition agreement matrix %s of the checkpointed run was not found." % pa_file)
+
+        rows = None
+        start = time.perf_counter()
+        if n_processes > 1 and analyzed_keys:
+            costs = estimate_costs(partitions, analyzed_keys, partitions.pattern_weights.keys() if engine in PATTERN_ENGINES else partitions.bit_parts.keys())
+            result, rows, workers = calculate_tiger_rates_multiprocessing(partitions, analyzed_keys, engine, n_processes, chunk_size, schedule, costs, pa_file, pa_rows, on_result)
+            if worker_times != None:
+                worker_times.update(workers)
+        elif pa_file != None or pa_rows or checkpoint != None or progress != None:
+            result = {}
+            rows = {} if pa_rows else None
+            for chunk in split_chunks(analyzed_keys, chunk_size or PA_MATRIX_CHUNK_SIZE):
+                pid, busy, chunk_result, chunk_rows = calculate_tiger_rates_timed(partitions, chunk, engine, pa_file, pa_rows)
+                result.update(chunk_result)
+                on_result(chunk_result)
+                if pa_rows:
+                    rows.update(chunk_rows)
+        else:
+            result = ENGINES[engine](partitions, analyzed_keys)
+        if (n_processes <= 1 or not analyzed_keys) and worker_times != None:
+            worker_times[os.getpid()] = [len(analyzed_keys), time.perf_counter() - start]
+    finally:
+        if checkpoint_file != None:
+            checkpoint_file.close()
+    result.update(previous)
+
+    rates = [result.get(partitions.representatives[site] if engine in PATTERN_ENGINES else site) for site in range(partitions.n_sites)]
+    if sites != None:
+        sites = set(sites)
+        rates = [rates[site] if site in sites else None for site in range(partitions.n_sites)]
+    if pa_rows:
+        return rates, [rows[partitions.representatives[site]] if engine in PATTERN_ENGINES else rows[site] for site in range(partitions.n_sites)]
+    return rates
+
+
+def shard_sites(partitions, shard, n_shards, engine="patterns"):
+    '''Return the sites of shard number shard (counting from 1) out of n_shards. The characters analyzed by the engine are ordered by estimated cost and dealt to the shards back and forth, so that the shards get roughly equal work, and all sites of a pattern go to the same shard. The same partitions always give the same shards.'''
+    if not 1 <= shard <= n_shards:
+        raise ValueError("Shard %i/%i does not exist." % (shard, n_shards))
+    if engine in PATTERN_ENGINES:
+        analyzed_keys = list(partitions.pattern_weights.keys())
+    else:
+        analyzed_keys = list(partitions.bit_parts.keys())
+    costs = estimate_costs(partitions, analyzed_keys, analyzed_keys)
+    ordered = sorted(analyzed_keys, key=lambda k: costs[k], reverse=True)
+    selected = set()
+    for i in range(len(ordered)):
+        turn = i % (2 * n_shards)
+        if turn == shard - 1 or turn == 2 * n_shards - shard:
+            selected.add(ordered[i])
+    if engine in PATTERN_ENGINES:
+        return sorted(site for site in range(partitions.n_sites) if partitions.representatives[site] in selected)
+    return sorted(selected)
+
+
+def shard_result(partitions, rates, shard, n_shards, engine="patterns"):
+    '''Return a self-describing partial result of a shard as a dict that can be saved as JSON. rates is the list returned by tiger_rates for the sites of the shard.'''
+    return {"format": "tiger-shard",
+            "version": 1,
+            "shard": shard,
+            "n_shards": n_shards,
+            "engine": engine,
+            "input_hash": partitions_key(partitions, engine),
+            "characters": [str(name) for name in partitions.names],
+            "rates": {str(site): rates[site] for site in range(partitions.n_sites) if rates[site] != None}}
+
+
+def merge_shards(shards):
+    '''Validate and combine the partial results of shard_result. All shards must come from the same input and options, and every shard must be present exactly once. Returns the character names and the list of rates in alignment order.'''
+    if not shards:
+        raise ValueError("No shards to merge.")
+    first = shards[0]
+    for shard in shards:
+        if shard.get("format") != "tiger-shard" or shard.get("version") != 1:
+            raise ValueError("Not a tiger-calculator shard result.")
+        for key in ("n_shards", "engine", "input_hash", "characters"):
+            if shard[key] != first[key]:
+                raise ValueError("Shard %i/%i does not match shard %i/%i: different %s." % (shard["shard"], shard["n_shards"], first["shard"], first["n_shards"], key))
+    numbers = sorted(shard["shard"] for shard in shards)
+    if numbers != list(range(1, first["n_shards"] + 1)):
+        missing = sorted(set(range(1, first["n_shards"] + 1)) - set(numbers))
+        duplicate = sorted(set(k for k in numbers if numbers.count(k) > 1))
+        raise ValueError("Expected shards 1 to %i. Missing: %s. Duplicated: %s." % (first["n_shards"], ", ".join(map(str, missing)) or "none", ", ".join(map(str, duplicate)) or "none"))
+    n_sites = len(first["characters"])
+    rates = [None] * n_sites
+    for shard in shards:
+        for site, rate in shard["rates"].items():
+            site = int(site)
+            if rates[site] != None:
+                raise ValueError("Character %s is in more than one shard." % first["characters"][site])
+            rates[site] = rate
+    missing = [first["characters"][site] for site in range(n_sites) if rates[site] == None]
+    if missing:
+        raise ValueError("No rates for characters %s." % ", ".join(missing))
+    return first["characters"], rates
+
+
+def cognate_partitions(resolved, taxon_bits, all_taxa, ignored_chars):
+    '''Encode the set partition of a meaning from resolved cognates in [taxon] format (see cldf.resolve_synonyms) in Partitions.bit_parts format. taxon_bits maps the index of each included taxon to its bitmask, and all_taxa is the bitmask of all included taxa. Taxa without a cognate form a partition of missing data unless it is ignored.'''
+    import cldf
+    masks = {}
+    present = 0
+    for lang, cognate in resolved.items():
+        bit = taxon_bits.get(lang)
+        if bit != None:
+            masks[cognate] = masks.get(cognate, 0) | bit
+            present |= bit
+    masks = list(masks.values())
+    if present != all_taxa and cldf.MISSING not in ignored_chars:
+        masks.append(all_taxa & ~present)
+    return tuple(masks), present if cldf.MISSING in ignored_chars else all_taxa
+
+
+def calculate_replicate(data, replicate):
+    '''Resample the synonyms of the meanings with synonyms and calculate the TIGER rates of all meanings for one replicate. data is the dict built by replicate_rates. Only pairs involving a resampled meaning are compared; the sums between meanings without synonyms come from data["fixed_sums"].'''
+    import cldf
+    rng = random.Random("%s-%i" % (data["seed"], replicate))
+    affected_meanings = data["affected_meanings"]
+    resolved = cldf.resolve_synonyms_random([data["cognates"][m] for m in affected_meanings], data["cognate_names"], rng)
+    affected_parts = []
+    for i in range(len(affected_meanings)):
+        affected_parts.append(cognate_partitions(resolved[i], data["taxon_bits"], data["all_taxa"], data["ignored_chars"]))
+        if affected_parts[-1][0] == ():
+            raise ValueError("Error: Empty character alignment for meaning %s in replicate %i. TIGER rates not calculated." % (data["meanings"][affected_meanings[i]], replicate))
+    compared_affected = [(masks, 1) for masks, valid in affected_parts]
+    n_compared = len(data["meanings"]) - 1
+    results = {}
+    for x in data["fixed_sums"].keys():
+        sums = add_sums(dict(data["fixed_sums"][x]), agreement_sums(data["fixed_parts"][x], compared_affected))
+        results[x] = sums_to_rate(sums, n_compared)
+    for i in range(len(affected_meanings)):
+        sums = add_sums(agreement_sums(affected_parts[i], data["fixed_patterns"]), agreement_sums(affected_parts[i], compared_affected))
+        sums[len(affected_parts[i][0])] -= len(affected_parts[i][0]) # compared against itself with pa(i,i) = 1
+        results[affected_meanings[i]] = sums_to_rate(sums, n_compared)
+    return results
+
+
+def replicate_rates(cognate_data, n_replicates, ignored_chars=(), excluded_taxa=(), seed=None, n_processes=1):
+    '''Calculate TIGER rates for replicates of the random synonym strategy. cognate_data is the output of CldfReader.readCognates, which is read only once. Meanings where no included language has synonyms are resolved once, and their agreement sums with each other are shared by all replicates. Returns a list of replicate results with [meaning] format.'''
+    taxa, meanings, cognate_names, cognates = cognate_data
+    excluded_taxa = set(excluded_taxa) - {""}
+    for taxon in excluded_taxa:
+        if taxon not in taxa:
+            raise ValueError("Taxon %s not found in data." % taxon)
+    included = [i for i in range(len(taxa)) if taxa[i] not in excluded_taxa]
+    taxon_bits = {included[j]: 1 << j for j in range(len(included))}
+    all_taxa = (1 << len(included)) - 1
+
+    if len(included) == 0 or len(meanings) == 0:
+        raise ValueError("Error: Empty characters or taxa in input file.")
+
+    affected_meanings = []
+    fixed_parts = {}
+    for m in range(len(meanings)):
+        if any(len(cognates[m][lang]) > 1 for lang in cognates[m].keys() if lang in taxon_bits):
+            affected_meanings.append(m)
+            continue
+        resolved = {lang: next(iter(options)) for lang, options in cognates[m].items()}
+        fixed_parts[m] = cognate_partitions(resolved, taxon_bits, all_taxa, ignored_chars)
+        if fixed_parts[m][0] == ():
+            raise ValueError("Error: Empty character alignment for meaning %s. TIGER rates not calculated." % meanings[m])
+
+    # Agreement sums between meanings without synonyms are shared by all replicates
+    representatives, pattern_weights = site_patterns(fixed_parts)
+    fixed_patterns = [(fixed_parts[y][0], pattern_weights[y]) for y in pattern_weights.keys()]
+    pattern_sums = {}
+    for x in pattern_weights.keys():
+        pattern_sums[x] = agreement_sums(fixed_parts[x], fixed_patterns)
+        pattern_sums[x][len(fixed_parts[x][0])] -= len(fixed_parts[x][0]) # compared against itself with pa(i,i) = 1
+
+    data = {"seed": seed if seed != None else random.randrange(2**32),
+            "meanings": meanings,
+            "cognates": cognates,
+            "cognate_names": cognate_names,
+            "taxon_bits": taxon_bits,
+            "all_taxa": all_taxa,
+            "ignored_chars": ignored_chars,
+            "affected_meanings": affected_meanings,
+            "fixed_parts": fixed_parts,
+            "fixed_patterns": fixed_patterns,
+            "fixed_sums": {x: pattern_sums[representatives[x]] for x in fixed_parts.keys()}}
+    return map_items(calculate_replicate, data, range(n_replicates), n_processes)
+
+
+def calculate_taxon_replicate(partitions, taxa_mask):
+    '''Calculate the TIGER rates of all characters using only the taxa in taxa_mask. Characters without any data for these taxa are left out of the comparisons and the results.'''
+    parts = {}
+    for site in partitions.bit_parts.keys():
+        masks = tuple(mask & taxa_mask for mask in partitions.bit_parts[site][0] if mask & taxa_mask)
+        if masks:
+            parts[site] = (masks, partitions.bit_parts[site][1] & taxa_mask)
+    representatives, weights = site_patterns(parts)
+    compared = [(parts[y][0], weights[y]) for y in weights.keys()]
+    pattern_rates = {}
+    for x in weights.keys():
+        sums = agreement_sums(parts[x], compared)
+        sums[len(parts[x][0])] -= len(parts[x][0]) # compared against itself with pa(i,i) = 1
+        pattern_rates[x] = sums_to_rate(sums, len(parts) - 1) if len(parts) > 1 else math.nan
+    return {site: pattern_rates[representatives[site]] for site in parts.keys()}
+
+
+def jackknife_rates(alignment, n_processes=1, **kwargs):
+    '''Calculate TIGER rates leaving out each taxon in turn. Each replicate restricts the same partitions to a subset of the taxa. Returns a list of replicate results with [site] format.'''
+    partitions = get_partitions(alignment, **kwargs)
+    n_taxa = len(partitions.taxa)
+    taxa_masks = [((1 << n_taxa) - 1) & ~(1 << i) for i in range(n_taxa)]
+    return map_items(calculate_taxon_replicate, partitions, taxa_masks, n_processes)
+
+
+def bootstrap_rates(alignment, n_samples, seed=None, n_processes=1, **kwargs):
+    '''Calculate TIGER rates for bootstrap samples of the taxa. Sampling a taxon more than once does not change any subset relation, so a bootstrap sample is the set of distinct taxa drawn. Returns a list of replicate results with [site] format.'''
+    partitions = get_partitions(alignment, **kwargs)
+    n_taxa = len(partitions.taxa)
+    rng = random.Random(seed)
+    taxa_masks = []
+    for r in range(n_samples):
+        taxa_mask = 0
+        for i in range(n_taxa):
+            taxa_mask |= 1 << rng.randrange(n_taxa)
+        taxa_masks.append(taxa_mask)
+    return map_items(calculate_taxon_replicate, partitions, taxa_masks, n_processes)
+
+
+def summarize_rates(rates, jackknife=False):
+    '''Return the mean, standard error and 2.5%, 50% and 97.5% quantiles of replicate TIGER rates. The standard error is the jackknife standard error if jackknife is set, and the standard deviation otherwise.'''
+    if len(rates) < 2:
+        return [math.nan] * 5
+    mean = statistics.fmean(rates)
+    if jackknife:
+        error = math.sqrt((len(rates) - 1) / len(rates) * sum((r - mean) ** 2 for r in rates))
+    else:
+        error = statistics.stdev(rates)
+    quantiles = statistics.quantiles(rates, n=40, method="inclusive")
+    return [mean, error, quantiles[0], quantiles[19], quantiles[38]]
+
+
+def summarize_replicates(results, n_sites, jackknife=False):
+    '''Return summarize_rates of each character over a list of replicate results with [site] format'''
+    return [summarize_rates([result[k] for result in results if k in result], jackknife) for k in range(n_sites)]
+
+
+def estimate_tiger_rate(data, x):
+    '''Estimate the TIGER rate of character x from random samples of data["sample_size"] other characters. data is the dict built by approximate_rates. Sampling continues while the confidence interval is wider than data["width"] or contains data["threshold"] (where these are set). Once half of the characters have been sampled, the rest are compared too and the exact rate is returned. The standard error is 0 only for exact rates. Returns the estimate, its standard error and the number of characters compared.'''
+    bit_parts = data["partitions"].bit_parts
+    sample_size = data["sample_size"]
+    rng = random.Random("%s-%i" % (data["seed"], x))
+    sites = list(bit_parts.keys())
+    n_population = len(sites) - 1
+    seen = {x}
+    sums = {}
+    squares = 0.0 # sum of squares of pa(i,j)
+    k = 0
+    while True:
+        if k + sample_size >= n_population / 2:
+            sample = [y for y in sites if y not in seen]
+        else:
+            sample = []
+            while len(sample) < sample_size:
+                y = sites[rng.randrange(len(sites))]
+                if y not in seen:
+                    seen.add(y)
+                    sample.append(y)
+        agreements = partition_agreements(bit_parts[x], [bit_parts[y][0] for y in sample])
+        for i in range(len(sample)):
+            total = len(bit_parts[sample[i]][0])
+            sums[total] = sums.get(total, 0) + agreements[i]
+            squares += (agreements[i] / total) ** 2
+        k += len(sample)
+        rate = sums_to_rate(sums, k)
+        if k == n_population:
+            return rate, 0.0, k
+        # Variance of the sample with two pseudo-observations pa = 0 and pa = 1 added, so that a sample in which all pa(i,j)
+        # are equal (often all 0) does not give a standard error of 0 for a rate that is not exact
+        total_pa = rate * k + 1
+        variance = max(0.0, (squares + 1 - total_pa * total_pa / (k + 2)) / (k + 1))
+        error = math.sqrt(variance / k * (n_population - k) / (n_population - 1)) # with finite population correction
+        half_width = CONFIDENCE_Z * error
+        if (data["width"] == None or 2 * half_width <= data["width"]) and (data["threshold"] == None or abs(rate - data["threshold"]) > half_width):
+            return rate, error, k
+
+
+def estimate_tiger_rates(data, analyzed_keys):
+    '''Estimate the TIGER rates of the characters specified by the array keys with estimate_tiger_rate'''
+    return {x: estimate_tiger_rate(data, x) for x in analyzed_keys}
+
+
+def approximate_rates(alignment, sample_size, target_width=None, threshold=None, seed=None, n_processes=1, chunk_size=None, **kwargs):
+    '''Estimate the TIGER rate of each character by comparing it against random samples of sample_size other characters (see estimate_tiger_rate). Returns a list of (estimate, standard error, number of characters compared) tuples in alignment order.'''
+    if sample_size < 2:
+        raise ValueError("The sample size must be at least 2.")
+    partitions = get_partitions(alignment, **kwargs)
+    data = {"partitions": partitions,
+            "sample_size": sample_size,
+            "width": target_width,
+            "threshold": threshold,
+            "seed": seed if seed != None else random.randrange(2**32)}
+    analyzed_keys = list(partitions.bit_parts.keys())
+    estimates = {}
+    if n_processes > 1:
+        chunk_size = chunk_size or max(1, len(analyzed_keys) // (n_processes * CHUNKS_PER_PROCESS))
+        for chunk_estimates in map_items(estimate_tiger_rates, data, split_chunks(analyzed_keys, chunk_size), n_processes, 1):
+            estimates.update(chunk_estimates)
+    else:
+        estimates = estimate_tiger_rates(data, analyzed_keys)
+    return [estimates[site] for site in range(partitions.n_sites)]
+
+
+def load_incremental_state(path):
+    '''Read the taxa, character names, partitions and agreement sums saved by save_incremental_state. Returns None if the file does not exist.'''
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    parts = []
+    for masks in state["partitions"]:
+        masks = tuple(int(mask, 16) for mask in masks)
+        valid = 0
+        for mask in masks:
+            valid |= mask
+        parts.append((masks, valid))
+    sums = [{total: agreements for total, agreements in character_sums} for character_sums in state["sums"]]
+    return state["taxa"], state["characters"], parts, sums
+
+
+def save_incremental_state(path, taxa, names, bit_parts, sums):
+    '''Save the taxa, character names, partitions and agreement sums of a calculation, so that it can be updated later with incremental_rates. The file is written under a temporary name and then renamed.'''
+    state = {"taxa": taxa,
+             "characters": [str(name) for name in names],
+             "partitions": [["%x" % mask for mask in bit_parts[site][0]] for site in bit_parts.keys()],
+             "sums": [sorted(sums[site].items()) for site in bit_parts.keys()]}
+    tmp_path = "%s.%i.tmp" % (path, os.getpid())
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def calculate_incremental_chunk(data, analyzed_keys):
+    '''Calculate the agreement sums of the characters specified by the array keys. data is the dict built by incremental_rates or multi_rates, with the partitions of all characters in data["bit_parts"]. Characters in data["previous_sums"] are updated by removing the agreements with the partitions in data["removed_parts"] and adding the agreements with the partitions in data["added_parts"], other characters are compared against all unique site patterns in data["compared_patterns"], a list of (bitmasks of states, weight) pairs.'''
+    bit_parts = data["bit_parts"]
+    results = {}
+    for x in analyzed_keys:
+        if x in data["previous_sums"]:
+            sums = dict(data["previous_sums"][x])
+            for total, agreements in agreement_sums(data["previous_parts"][x], data["removed_parts"]).items():
+                sums[total] -= agreements
+            results[x] = add_sums(sums, agreement_sums(bit_parts[x], data["added_parts"]))
+        else:
+            results[x] = agreement_sums(bit_parts[x], data["compared_patterns"])
+            results[x][len(bit_parts[x][0])] -= len(bit_parts[x][0]) # compared against itself with pa(i,i) = 1
+    return results
+
+
+def incremental_rates(alignment, state_file, n_processes=1, chunk_size=None, **kwargs):
+    '''Calculate TIGER rates reusing the agreement sums in state_file for the characters whose partitions have not changed since it was written, and save the new sums to it. Characters are identified by their names, which must be unique. Gives the same rates as the exact engine.'''
+    partitions = get_partitions(alignment, **kwargs)
+    taxa = partitions.taxa
+    names = partitions.names
+    bit_parts = partitions.bit_parts
+    if len(set(names)) != len(names):
+        raise ValueError("Character names must be unique in incremental mode.")
+    state = load_incremental_state(state_file)
+    previous_sums = {}
+    previous_parts = {}
+    removed_parts = []
+    if state != None:
+        old_taxa, old_names, old_parts, old_sums = state
+        taxon_bits = {taxa[j]: 1 << j for j in range(len(taxa))}
+        remapped_taxa = [(1 << i, taxon_bits[old_taxa[i]]) for i in range(len(old_taxa)) if old_taxa[i] in taxon_bits]
+        removed_taxa = sum(1 << i for i in range(len(old_taxa)) if old_taxa[i] not in taxon_bits)
+        sites = {str(names[site]): site for site in bit_parts.keys()}
+        for i in range(len(old_names)):
+            site = sites.get(old_names[i])
+            if site != None and old_parts[i][1] & removed_taxa == 0:
+                remapped = sorted(sum(new_bit for old_bit, new_bit in remapped_taxa if mask & old_bit) for mask in old_parts[i][0])
+                if remapped == sorted(bit_parts[site][0]):
+                    previous_sums[site] = old_sums[i]
+                    previous_parts[site] = old_parts[i]
+                    continue
+            removed_parts.append((old_parts[i][0], 1))
+    data = {"bit_parts": bit_parts,
+            "compared_patterns": [(bit_parts[y][0], partitions.pattern_weights[y]) for y in partitions.pattern_weights.keys()],
+            "previous_sums": previous_sums,
+            "previous_parts": previous_parts,
+            "removed_parts": removed_parts,
+            "added_parts": [(bit_parts[y][0], 1) for y in bit_parts.keys() if y not in previous_sums]}
+    analyzed_keys = list(bit_parts.keys())
+    if n_processes > 1:
+        chunk_size = chunk_size or max(1, len(analyzed_keys) // (n_processes * CHUNKS_PER_PROCESS))
+        sums = {}
+        for chunk_sums in map_items(calculate_incremental_chunk, data, split_chunks(analyzed_keys, chunk_size), n_processes, 1):
+            sums.update(chunk_sums)
+    else:
+        sums = calculate_incremental_chunk(data, analyzed_keys)
+    save_incremental_state(state_file, taxa, names, bit_parts, sums)
+    return [sums_to_rate(sums[site], partitions.n_sites - 1) for site in range(partitions.n_sites)]
+
+
+
+def configuration_parts(alignment, site_masks, ignored_chars=(), excluded_taxa=()):
+    '''Derive the partitions of one configuration of ignored characters and excluded taxa from the unmasked partitions of all sites (see Alignment.getSiteMasks). Returns a dict with [site] format like Partitions.bit_parts, except that bit j stands for the j-th taxon of the whole alignment, so that the partitions of different configurations can be compared. The masks of each site are sorted.'''
+    missing_codes = alignment.getMissingCodes(ignored_chars)
+    taxon_flags = alignment.getTaxonFlags(excluded_taxa)
+    included = (1 << len(alignment.taxa)) - 1
+    if taxon_flags != None:
+        included = sum(1 << j for j in range(len(taxon_flags)) if taxon_flags[j])
+    if included == 0:
+        raise ValueError("Error: Empty characters or taxa in input file.")
+    bit_parts = {}
+    for site in range(len(site_masks)):
+        masks = tuple(sorted(mask & included for code, mask in site_masks[site] if code not in missing_codes and mask & included))
+        if masks == ():
+            raise ValueError("Error: Empty character alignment at position " + str(site) + ". TIGER rates not calculated.")
+        valid = 0
+        for mask in masks:
+            valid |= mask
+        bit_parts[site] = (masks, valid)
+    return bit_parts
+
+
+def multi_rates(alignment, configurations, n_processes=1, chunk_size=None, taxa=None, names=None):
+    '''Calculate TIGER rates for each of a list of (ignored characters, excluded taxa) configurations. The partitions of the alignment are built once and each configuration is derived from them with masks. A configuration is calculated from the agreement sums of the earlier configuration with the fewest changed partitions, like incremental_rates, when that is cheaper than comparing all its site patterns. Returns a list with the rates of each configuration in [site] format. Gives the same rates as the exact engine.'''
+    alignment = encode_alignment(alignment, taxa, names)
+    n_sites = alignment.n_sites
+    if len(alignment.taxa) == 0 or n_sites == 0:
+        raise ValueError("Error: Empty characters or taxa in input file.")
+    site_masks = [alignment.getSiteMasks(site) for site in range(n_sites)]
+    results = []
+    previous = [] # (bit_parts, sums) of each earlier configuration
+    for ignored_chars, excluded_taxa in configurations:
+        bit_parts = configuration_parts(alignment, site_masks, ignored_chars, excluded_taxa)
+        representatives, pattern_weights = site_patterns(bit_parts)
+        n_patterns = len(pattern_weights)
+        # Comparing all patterns against each other, or updating the sums of an earlier configuration
+        best_cost = n_patterns * n_patterns
+        base = None
+        for old_parts, old_sums in previous:
+            changed = [site for site in range(n_sites) if old_parts[site][0] != bit_parts[site][0]]
+            changed_patterns = len({representatives[site] for site in changed})
+            cost = (n_patterns - changed_patterns) * 2 * len(changed) + changed_patterns * n_patterns
+            if cost < best_cost:
+                best_cost = cost
+                base = (old_parts, old_sums, changed)
+        data = {"bit_parts": bit_parts,
+                "compared_patterns": [(bit_parts[y][0], pattern_weights[y]) for y in pattern_weights.keys()],
+                "previous_sums": {},
+                "previous_parts": {},
+                "removed_parts": [],
+                "added_parts": []}
+        if base != None:
+            old_parts, old_sums, changed = base
+            changed_sites = set(changed)
+            data["previous_sums"] = {site: old_sums[site] for site in pattern_weights.keys() if site not in changed_sites}
+            data["previous_parts"] = {site: old_parts[site] for site in data["previous_sums"].keys()}
+            data["removed_parts"] = [(old_parts[site][0], 1) for site in changed]
+            data["added_parts"] = [(bit_parts[site][0], 1) for site in changed]
+        # Sites with identical partitions have identical sums, so only the first site of each pattern is calculated
+        analyzed_keys = list(pattern_weights.keys())
+        if n_processes > 1:
+            chunks = split_chunks(analyzed_keys, chunk_size or max(1, len(analyzed_keys) // (n_processes * CHUNKS_PER_PROCESS)))
+            pattern_sums = {}
+            for chunk_sums in map_items(calculate_incremental_chunk, data, chunks, n_processes, 1):
+                pattern_sums.update(chunk_sums)
+        else:
+            pattern_sums = calculate_incremental_chunk(data, analyzed_keys)
+        sums = {site: pattern_sums[representatives[site]] for site in range(n_sites)}
+        previous.append((bit_parts, sums))
+        results.append([sums_to_rate(sums[site], n_sites - 1) for site in range(n_sites)])
+    return results
+
+if __name__ == '__main__':
+    print("Library interface of tiger-calculator")